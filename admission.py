@@ -0,0 +1,184 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from exceptions import CryptoportBackpressureException
+
+DEFAULT_MAX_IN_FLIGHT = int(os.environ.get('CRYPTOPORT_MAX_IN_FLIGHT', 32))
+
+# Seconds a shed caller is told to wait before trying again.
+DEFAULT_RETRY_AFTER = 1
+
+DEFAULT_IDEMPOTENCY_CACHE_SIZE = 10000
+DEFAULT_IDEMPOTENCY_TTL = 600
+
+# Marks a key whose first submission has not finished yet.
+IN_FLIGHT = object()
+
+
+class SubmissionGate:
+    """Caps the batch submissions in flight in this process.
+
+    Callers over the cap are turned away immediately instead of queueing
+    behind a validator that is already pushing back. The counters double as
+    gauges for the submission path.
+    """
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+
+        self._lock = threading.Lock()
+        self._held = threading.local()
+        self._in_flight = 0
+        self._backing_off = 0
+        self._submitted = 0
+        self._shed = 0
+        self._queue_full = 0
+        self._retries = 0
+
+    @contextmanager
+    def slot(self):
+        """Holds one in-flight slot, or raises if none is free.
+
+        Nested calls on the same thread share the outer slot, so a caller
+        can reserve before signing and send_transaction does not count the
+        submission twice.
+        """
+        if getattr(self._held, 'depth', 0):
+            self._held.depth += 1
+            try:
+                yield
+            finally:
+                self._held.depth -= 1
+            return
+
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                self._shed += 1
+                raise CryptoportBackpressureException(
+                    'Too many submissions in flight ({})'.format(
+                        self._in_flight),
+                    retry_after=DEFAULT_RETRY_AFTER)
+            self._in_flight += 1
+
+        self._held.depth = 1
+        try:
+            yield
+        finally:
+            self._held.depth = 0
+            with self._lock:
+                self._in_flight -= 1
+
+    @contextmanager
+    def backing_off(self):
+        with self._lock:
+            self._queue_full += 1
+            self._retries += 1
+            self._backing_off += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._backing_off -= 1
+
+    def record_queue_full(self):
+        with self._lock:
+            self._queue_full += 1
+
+    def record_submitted(self):
+        with self._lock:
+            self._submitted += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'max_in_flight': self.max_in_flight,
+                'backing_off': self._backing_off,
+                'submitted': self._submitted,
+                'shed': self._shed,
+                'queue_full': self._queue_full,
+                'retries': self._retries,
+            }
+
+
+class IdempotencyCache:
+    """Remembers recently submitted idempotency keys and their results.
+
+    Bounded both by age and by size; the oldest keys go first.
+    """
+    def __init__(self, max_size=DEFAULT_IDEMPOTENCY_CACHE_SIZE,
+                 ttl=DEFAULT_IDEMPOTENCY_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _expire(self, now):
+        while self._entries:
+            key, (stored_at, _) = next(iter(self._entries.items()))
+            if now - stored_at < self.ttl and \
+                    len(self._entries) <= self.max_size:
+                return
+            del self._entries[key]
+
+    def get(self, key):
+        with self._lock:
+            self._expire(time.time())
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def reserve(self, key):
+        """Claims key for a new submission.
+
+        Returns None when the caller should submit, IN_FLIGHT when another
+        caller is already submitting it, or the stored result.
+        """
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[1]
+            self._entries[key] = (now, IN_FLIGHT)
+            return None
+
+    def release(self, key):
+        """Drops a reservation whose submission failed.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is IN_FLIGHT:
+                del self._entries[key]
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), result)
+            self._expire(time.time())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+SUBMISSIONS = SubmissionGate()
+
+SUBMITTED_KEYS = IdempotencyCache()
@@ -14,14 +14,21 @@
 # ------------------------------------------------------------------------------
 from collections import defaultdict
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS, cross_origin
 
 import getpass
+import math
 import os
 import requests
 
+from admission import SUBMISSIONS, SUBMITTED_KEYS, DEFAULT_RETRY_AFTER
+from admission import IN_FLIGHT
 from cryptoport_client import CryptoportClient
+from exceptions import CryptoportBackpressureException
+from exportops import EXPORT_FORMATS, MIME_TYPES
+from tranops import idempotency_digest
+from handler import DATE_FORMAT
 
 DEFAULT_URL = 'http://127.0.0.1:8008'
 LIVE_PRICE_URL = "https://api.coingecko.com/api/v3/simple/price"
@@ -36,6 +43,10 @@ cors = CORS(app)
 url      = 'http://rest-api:8008'
 keyfile  = None    
 
+# Keyed submissions are signed with a key derived from this secret, so that
+# a retry gets the original transaction ID from any API process.
+signing_secret = os.environ.get('CRYPTOPORT_SIGNING_SECRET')
+
 class dict2class(object):
     def __init__(self, d):
         for k in d:
@@ -54,6 +65,22 @@ def get_transactions():
     value_list    = client.list()
     return jsonify(value_list)
 
+@app.route("/transactions/export")
+@cross_origin()
+def export_transactions():
+    fmt = request.args.get("format", "arrow")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "format must be one of {}".format(
+            ", ".join(EXPORT_FORMATS))}), 400
+
+    args_dict     = {"url":url, "keyfile":keyfile}    
+    args          = dict2class(args_dict)
+    client        = _get_client(args, False)
+    chunks        = client.export(fmt=fmt)
+    return Response(chunks, mimetype=MIME_TYPES[fmt], headers={
+        "Content-Disposition": "attachment; filename=transactions.{}".format(
+            fmt)})
+
 @app.route("/transactions", methods=["POST"])
 def new_transaction():
 
@@ -71,20 +98,57 @@ def new_transaction():
     'symbol'             : request.json["symbol"],
     'type'               : int(request.json["type"]),
     'amount'             : request.json["amount"],
-    'time_transacted'    : datetime.fromtimestamp(request.json["time_transacted"]).strftime("%m-%d-%Y"),
-    'time_created'       : datetime.fromtimestamp(request.json["time_created"]).strftime("%m-%d-%Y"),
+    'time_transacted'    : datetime.fromtimestamp(request.json["time_transacted"]).strftime(DATE_FORMAT),
+    'time_created'       : datetime.fromtimestamp(request.json["time_created"]).strftime(DATE_FORMAT),
     'price_purchased_at' : float(request.json["price_purchased_at"]),
     'no_of_coins'        : float(request.json.get("no_of_coins"))
     }
+    # A retried request with the same key and record gets the original
+    # transaction back instead of signing and submitting a new one.
+    idempotency_key = request.headers.get("Idempotency-Key")
+    cache_key = None
+    if idempotency_key is not None:
+        cache_key = idempotency_digest(idempotency_key, value)
+        cached = SUBMITTED_KEYS.reserve(cache_key)
+        if cached is IN_FLIGHT:
+            error = jsonify({"error": "A request with this Idempotency-Key "
+                                      "is already being submitted"})
+            return error, 409, {"Retry-After": str(DEFAULT_RETRY_AFTER)}
+        if cached is not None:
+            request.json["id"] = cached
+            return jsonify(request.json)
+
     wait = None
     args_dict   = {"url":url, "keyfile":keyfile}    
     args     = dict2class(args_dict)
-    client = _get_client(args, False) 
-    response = client.insert(value, wait)
+    response = None
+    # The slot is taken before a key is made or anything is signed, so an
+    # overloaded API sheds requests without paying for them.
+    try:
+        with SUBMISSIONS.slot():
+            client = _get_client(args, False) 
+            response = client.insert(value, wait, idempotency_key)
+    except CryptoportBackpressureException as err:
+        return _backpressure_response(err)
+    finally:
+        if cache_key is not None:
+            if response is None:
+                SUBMITTED_KEYS.release(cache_key)
+            else:
+                SUBMITTED_KEYS.put(cache_key, response)
 
     request.json["id"] = response
     return jsonify(request.json)
 
+def _backpressure_response(err):
+    retry_after = math.ceil(err.retry_after or DEFAULT_RETRY_AFTER)
+    error = jsonify({"error": str(err), "retry_after": retry_after})
+    return error, 503, {"Retry-After": str(retry_after)}
+
+@app.route("/submissions")
+def get_submissions():
+    return jsonify(SUBMISSIONS.snapshot())
+
 @app.route("/get_rollups_by_coin")
 def get_rollups_by_coin():
     args_dict   = {"url":url, "keyfile":keyfile}    
@@ -151,7 +215,8 @@ def get_rollups_by_coin():
 def _get_client(args, read_key_file=True):
     return CryptoportClient(
         url=DEFAULT_URL if args.url is None else args.url,
-        keyfile=_get_keyfile(args) if read_key_file else None)
+        keyfile=_get_keyfile(args) if read_key_file else None,
+        signing_secret=signing_secret)
 
 def _get_keyfile(args):
     try:
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+#
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+"""Times reads and inserts against growing history, with and without compact.
+
+Runs the client against an in-process SawtoothEmulator, so no validator is
+needed. History is seeded straight into the emulator's state; blocks are
+published by hand so that insert timings cover the processor's execution of
+the transaction rather than the block interval.
+"""
+
+import argparse
+import io
+import logging
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cbor
+
+from cryptoport_client import CryptoportClient
+from emulator import SawtoothEmulator
+from handler import make_cryptoport_address
+
+# Seeded history is dated before the cutoff, the tail and inserts after it.
+HISTORY_DATE = '01-01-2020'
+CUTOFF       = '01-01-2021'
+TAIL_DATE    = '01-01-2022'
+
+SYMBOLS = ['BTC', 'ETH', 'SOL', 'ADA']
+
+
+def _record(i, date):
+    return {
+        'name'               : 'bench',
+        'symbol'             : SYMBOLS[i % len(SYMBOLS)],
+        'type'               : 1 if i % 3 else 0,
+        'amount'             : 1000 + i,
+        'time_transacted'    : date,
+        'time_created'       : date,
+        'price_purchased_at' : 10.0,
+        'no_of_coins'        : 1.0,
+    }
+
+
+def _seed(emulator, history, tail):
+    records = [_record(i, HISTORY_DATE) for i in range(history)] + \
+              [_record(i, TAIL_DATE) for i in range(tail)]
+    emulator.load_state({
+        make_cryptoport_address('name'): cbor.dumps({'name': records})})
+
+
+def _timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def _compact(emulator, client):
+    # compact waits for its batch to be committed, so blocks are published
+    # by hand until it returns.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(client.compact, CUTOFF, io.BytesIO())
+        while not future.done():
+            emulator.publish_block()
+            time.sleep(0.01)
+        future.result()
+
+
+def _insert(emulator, client, i):
+    client.insert(_record(i, TAIL_DATE))
+    emulator.publish_block()
+
+
+def run(history, compact, tail, repeat):
+    # Blocks are published by hand, the interval only keeps the loop idle.
+    with SawtoothEmulator(port=0, block_interval=3600,
+                          max_queue_size=repeat + 1,
+                          verify_signatures=False) as emulator:
+        client = CryptoportClient(url=emulator.url)
+        _seed(emulator, history, tail)
+
+        if compact:
+            _compact(emulator, client)
+
+        counter = iter(range(sys.maxsize))
+        return {
+            'list'    : _timed(client.list, repeat),
+            'rollups' : _timed(client.rollups, repeat),
+            'insert'  : _timed(
+                lambda: _insert(emulator, client, next(counter)), repeat),
+        }
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        '-n', '--records',
+        type=int,
+        default=1000,
+        help='Smallest history size, in records')
+
+    parser.add_argument(
+        '--factor',
+        type=int,
+        default=10,
+        help='How much larger the second history is')
+
+    parser.add_argument(
+        '--tail',
+        type=int,
+        default=100,
+        help='Records newer than the cutoff, kept by compact')
+
+    parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        default=5,
+        help='Runs per measurement; the median is reported')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+
+    # Werkzeug logs every request the client makes to the emulator.
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    print('{:>10} {:>9} {:>10} {:>12} {:>11}'.format(
+        'history', 'compact', 'list ms', 'rollups ms', 'insert ms'))
+    for history in (opts.records, opts.records * opts.factor):
+        for compact in (False, True):
+            timings = run(history, compact, opts.tail, opts.repeat)
+            print('{:>10} {:>9} {:>10.2f} {:>12.2f} {:>11.2f}'.format(
+                history, 'yes' if compact else 'no', timings['list'],
+                timings['rollups'], timings['insert']))
+
+
+if __name__ == '__main__':
+    main()
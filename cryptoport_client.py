@@ -17,11 +17,16 @@ import yaml
 import base64
 import cbor
 import hashlib
+import hmac
 import json
 
+from datetime import datetime
+
 import pandas as pd
-from tranops    import CryptoPort
+from tranops    import CryptoPort, idempotency_digest
 from requestops import send_request
+from exportops  import iter_export, EXPORT_BATCH_SIZE
+from handler    import SNAPSHOT_KEY, DATE_FORMAT, transacted_before
 
 from exceptions import CryptoportClientException
 
@@ -31,12 +36,51 @@ from sawtooth_signing import ParseError
 from sawtooth_signing.secp256k1 import Secp256k1PrivateKey
 
 
+# Seconds compact waits for its batch to be committed.
+COMPACT_WAIT = 60
+
+
 def _sha512(data):
     return hashlib.sha512(data).hexdigest()
 
+def _idempotent_signer(signing_secret, digest):
+    # The same digest always gives the same key, so a retried request is
+    # signed into the very same transaction. The digest is public on chain
+    # as the payload Key, so it is keyed with a secret only the API holds.
+    private_key = Secp256k1PrivateKey.from_hex(hmac.new(
+        signing_secret.encode('utf-8'), digest.encode('utf-8'),
+        hashlib.sha256).hexdigest())
+    return CryptoFactory(create_context('secp256k1')).new_signer(private_key)
+
+def _snapshot_records(snapshot):
+    """Expands compacted snapshots into one record per symbol and type.
+    """
+    if not snapshot:
+        return []
+
+    records = []
+    for entry in snapshot['symbols'].values():
+        for tran_type, totals in entry['types'].items():
+            records.append({
+                'name'               : 'snapshot',
+                'symbol'             : entry['symbol'],
+                'type'               : int(tran_type) if tran_type.isdigit()
+                                       else tran_type,
+                'amount'             : totals['amount'],
+                'no_of_coins'        : totals['coins'],
+                'price_purchased_at' : totals['cost'] / totals['coins']
+                                       if totals['coins'] else 0,
+                'time_transacted'    : snapshot['cutoff'],
+                'time_created'       : snapshot['cutoff'],
+                'snapshot'           : True,
+            })
+    return records
+
 class CryptoportClient:
-    def __init__(self, url, keyfile=None):
+    def __init__(self, url, keyfile=None, signing_secret=None):
         self.url = url
+        self._ephemeral_signer = keyfile is None
+        self._signing_secret = signing_secret
         if keyfile is not None:
             try:
                 with open(keyfile) as fd:
@@ -86,14 +130,15 @@ class CryptoportClient:
     def list(self):
         data = self._get_state_data()
         if data:
-            return data['name']
+            return _snapshot_records(data.get(SNAPSHOT_KEY)) + \
+                data.get('name', [])
         else:
             return []
     
     def rollups(self):
-        data = self._get_state_data()
-        if data:
-            df   = pd.json_normalize(data['name'])
+        records = self.list()
+        if records:
+            df   = pd.json_normalize(records)
             return df.groupby(['symbol', 'type']).agg(
                 total_amount = ('amount','sum'), 
                 total_coins  = ('no_of_coins','sum'),
@@ -101,22 +146,113 @@ class CryptoportClient:
         else:
             return []
 
-    def insert(self, value, wait=None):
+    def export(self, sink=None, fmt='arrow', batch_size=EXPORT_BATCH_SIZE):
+        """Exports the transactions as an Arrow IPC stream or Parquet file.
+
+        Writes to sink when one is given, otherwise returns the chunks.
+        """
+        chunks = iter_export(self.list(), fmt, batch_size)
+        if sink is None:
+            return chunks
+
+        for chunk in chunks:
+            sink.write(chunk)
+
+    def compact(self, cutoff, archive, fmt='parquet', wait=COMPACT_WAIT):
+        """Folds transactions before cutoff (%m-%d-%Y) into snapshots.
+
+        The folded transactions are written to archive first, as they are
+        no longer kept in state afterwards. The call then waits up to wait
+        seconds for the compaction to be committed, and raises if it was
+        rejected (e.g. another compaction got there first) or is still
+        pending. In that case the archive holds transactions that may
+        still be in state.
+        """
+        if archive is None:
+            raise CryptoportClientException(
+                'Compacting needs an archive for the folded transactions')
+
+        try:
+            cutoff_date = datetime.strptime(cutoff, DATE_FORMAT).date()
+        except (TypeError, ValueError) as e:
+            raise CryptoportClientException(
+                'Invalid cutoff: {}'.format(str(e))) from e
+
+        data     = self._get_state_data() or {}
+        records  = data.get('name', [])
+        snapshot = data.get(SNAPSHOT_KEY) or {}
+
+        folded = [record for record in records
+                  if transacted_before(record, cutoff_date)]
+        for chunk in iter_export(folded, fmt):
+            archive.write(chunk)
+
+        value = {
+            'cutoff'  : cutoff,
+            'upto'    : len(records),
+            'version' : snapshot.get('version', 0),
+        }
+        transactions = CryptoPort.create_cryptoport_transactions(
+            'compact', 'name', value, self._signer)
+        batch_list   = CryptoPort.create_batch(transactions, self._signer)
+        CryptoPort().send_transaction(self.url, batch_list)
+
+        status = self._batch_status(
+            batch_list.batches[0].header_signature, wait)
+        if status.get('status') != 'COMMITTED':
+            reasons = [t.get('message') for t in
+                       status.get('invalid_transactions') or []]
+            raise CryptoportClientException(
+                'Compaction {}{}; the archive holds transactions that may '
+                'still be in state'.format(
+                    str(status.get('status')).lower(),
+                    ': {}'.format('; '.join(reasons)) if reasons else ''))
+
+        return transactions[0].header_signature
+
+    def _batch_status(self, batch_id, wait):
+        result, _ = send_request(self.url,
+            'batch_statuses?id={}&wait={}'.format(batch_id, wait))
+        try:
+            return yaml.safe_load(result)['data'][0]
+        except (KeyError, IndexError, TypeError) as e:
+            raise CryptoportClientException(
+                'Unexpected batch status: {}'.format(result)) from e
+
+    def insert(self, value, wait=None, idempotency_key=None):
         if not value:
             raise CryptoportClientException("no value provided")
         
         return self.tran_ops('insert', 'name',
-                             value, self._signer, wait)
+                             value, self._signer_for(value, idempotency_key),
+                             wait, idempotency_key)
+
+    def _signer_for(self, value, idempotency_key):
+        """Returns the signer for an insert.
+
+        Without a keyfile the default key is random per client, which would
+        give every retry of a keyed insert a new transaction ID. Given a
+        signing secret, keyed inserts are signed with a key derived from it
+        instead. Without either, retries still cannot be committed twice,
+        but each one gets its own transaction ID.
+        """
+        if idempotency_key is None or not self._ephemeral_signer or \
+                self._signing_secret is None:
+            return self._signer
+        return _idempotent_signer(self._signing_secret,
+                                  idempotency_digest(idempotency_key, value))
     
     #Build the transactions and their batches for transporting to processor.
-    def tran_ops(self,verb, name, value, signer, wait):
+    #Returns the ID of the submitted transaction.
+    def tran_ops(self,verb, name, value, signer, wait, idempotency_key=None):
         data_tran_list      = CryptoPort.create_cryptoport_transactions(
                                 verb,
                                 name,
                                 value,
-                                signer)
+                                signer,
+                                idempotency_key=idempotency_key)
 
         data_batchlist = CryptoPort.create_batch(data_tran_list, signer)
 
-        return CryptoPort().send_transaction(self.url,
-                                              data_batchlist, wait=wait)[0]
\ No newline at end of file
+        CryptoPort().send_transaction(self.url, data_batchlist, wait=wait)
+        return data_tran_list[0].header_signature
\ No newline at end of file
@@ -0,0 +1,532 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import argparse
+import base64
+import hashlib
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+
+from sawtooth_sdk.processor.exceptions import AuthorizationException
+from sawtooth_sdk.processor.exceptions import InternalError
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.protobuf import batch_pb2
+from sawtooth_sdk.protobuf import processor_pb2
+from sawtooth_sdk.protobuf import state_context_pb2
+from sawtooth_sdk.protobuf import transaction_pb2
+from sawtooth_signing import create_context
+from sawtooth_signing.secp256k1 import Secp256k1PublicKey
+
+from handler import CrypoportTransactionHandler
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8008
+
+DEFAULT_BLOCK_INTERVAL = 1.0
+DEFAULT_MAX_QUEUE_SIZE = 100
+DEFAULT_PAGING_LIMIT = 1000
+
+# Error codes and titles used by the Sawtooth REST API.
+ERRORS = {
+    'NO_BATCHES_SUBMITTED': (34, 'No Batches Submitted', 400),
+    'BAD_PROTOBUF': (35, 'Protobuf Not Decodable', 400),
+    'INVALID_BATCH': (30, 'Submitted Batches Invalid', 400),
+    'QUEUE_FULL': (31, 'Unable to Accept Batches', 429),
+    'STATUS_ID_QUERY_INVALID': (66, 'Id Query Invalid or Missing', 400),
+    'STATE_NOT_FOUND': (75, 'State Not Found', 404),
+}
+
+PENDING = 'PENDING'
+COMMITTED = 'COMMITTED'
+INVALID = 'INVALID'
+UNKNOWN = 'UNKNOWN'
+
+
+def _sha512(data):
+    return hashlib.sha512(data).hexdigest()
+
+
+def _error(name, message):
+    code, title, status = ERRORS[name]
+    response = jsonify(
+        {'error': {'code': code, 'title': title, 'message': message}})
+    response.status_code = status
+    return response
+
+
+class _TransactionFailed(Exception):
+    def __init__(self, transaction_id, cause):
+        super().__init__(str(cause))
+        self.transaction_id = transaction_id
+        self.cause = cause
+
+
+class _BatchContext:
+    """An in-memory stand-in for the validator's state context.
+
+    Reads fall through to the committed state, writes are buffered so that a
+    batch is applied all or nothing.
+    """
+    def __init__(self, state):
+        self._state = state
+        self._writes = {}
+        self._inputs = []
+        self._outputs = []
+
+    def authorize(self, header):
+        self._inputs = list(header.inputs)
+        self._outputs = list(header.outputs)
+
+    def _check(self, addresses, allowed):
+        for address in addresses:
+            if not any(address.startswith(prefix) for prefix in allowed):
+                raise AuthorizationException(
+                    'Tried to access unauthorized address {}'.format(address))
+
+    def get_state(self, addresses, timeout=None):
+        self._check(addresses, self._inputs)
+
+        entries = []
+        for address in addresses:
+            data = self._writes.get(address, self._state.get(address))
+            if data is not None:
+                entries.append(
+                    state_context_pb2.TpStateEntry(address=address, data=data))
+        return entries
+
+    def set_state(self, entries, timeout=None):
+        self._check(entries.keys(), self._outputs)
+
+        self._writes.update(entries)
+        return list(entries.keys())
+
+    def commit(self):
+        self._state.update(self._writes)
+
+
+class SawtoothEmulator:
+    """Serves the subset of the Sawtooth REST API used by cryptoport.
+
+    Submitted batches are validated on arrival, queued, and executed through
+    CrypoportTransactionHandler once per block interval.
+    """
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 block_interval=DEFAULT_BLOCK_INTERVAL,
+                 max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+                 verify_signatures=True):
+        self.host = host
+        self.port = port
+        self.block_interval = block_interval
+        self.max_queue_size = max_queue_size
+        self.verify_signatures = verify_signatures
+
+        self._handler = CrypoportTransactionHandler()
+        self._context = create_context('secp256k1')
+
+        self._state = {}
+        self._queue = []
+        self._statuses = OrderedDict()
+        self._committed_transactions = set()
+        self._block_num = 0
+        self._head = '0' * 128
+
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._server = None
+        self._threads = []
+
+        self.app = self._create_app()
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    @property
+    def queue_size(self):
+        with self._condition:
+            return len(self._queue)
+
+    def load_state(self, entries):
+        """Writes raw state entries directly, e.g. to seed a long history
+        without replaying it transaction by transaction.
+        """
+        with self._condition:
+            self._state.update(entries)
+
+    # --- Validation ---------------------------------------------------------
+
+    def _validate_batch(self, batch):
+        header = batch_pb2.BatchHeader()
+        header.ParseFromString(batch.header)
+
+        if self.verify_signatures and not self._verify(
+                batch.header_signature, batch.header,
+                header.signer_public_key):
+            raise InvalidTransaction(
+                'Invalid signature on batch {}'.format(batch.header_signature))
+
+        if list(header.transaction_ids) != [
+                t.header_signature for t in batch.transactions]:
+            raise InvalidTransaction(
+                'Transaction ids of batch {} do not match its transactions'
+                .format(batch.header_signature))
+
+        for transaction in batch.transactions:
+            self._validate_transaction(transaction, header.signer_public_key)
+
+    def _validate_transaction(self, transaction, batcher_public_key):
+        header = transaction_pb2.TransactionHeader()
+        header.ParseFromString(transaction.header)
+
+        if self.verify_signatures and not self._verify(
+                transaction.header_signature, transaction.header,
+                header.signer_public_key):
+            raise InvalidTransaction(
+                'Invalid signature on transaction {}'.format(
+                    transaction.header_signature))
+
+        if header.batcher_public_key != batcher_public_key:
+            raise InvalidTransaction(
+                'Transaction {} was not batched by its batcher'.format(
+                    transaction.header_signature))
+
+        if header.payload_sha512 != _sha512(transaction.payload):
+            raise InvalidTransaction(
+                'Payload hash mismatch on transaction {}'.format(
+                    transaction.header_signature))
+
+        if header.family_name != self._handler.family_name or \
+                header.family_version not in self._handler.family_versions:
+            raise InvalidTransaction(
+                'No handler for {} {}'.format(
+                    header.family_name, header.family_version))
+
+    def _verify(self, signature, message, public_key_hex):
+        try:
+            public_key = Secp256k1PublicKey.from_hex(public_key_hex)
+            return self._context.verify(signature, message, public_key)
+        except Exception:  # pylint: disable=broad-except
+            return False
+
+    # --- Execution ----------------------------------------------------------
+
+    def _execute_batch(self, batch):
+        context = _BatchContext(self._state)
+        for transaction in batch.transactions:
+            # Like the validator, a transaction is only ever committed once,
+            # whichever batch it arrives in.
+            if transaction.header_signature in self._committed_transactions:
+                raise _TransactionFailed(
+                    transaction.header_signature, InvalidTransaction(
+                        'Transaction {} has already been committed'.format(
+                            transaction.header_signature)))
+
+            header = transaction_pb2.TransactionHeader()
+            header.ParseFromString(transaction.header)
+
+            context.authorize(header)
+            try:
+                self._handler.apply(
+                    processor_pb2.TpProcessRequest(
+                        header=header,
+                        payload=transaction.payload,
+                        signature=transaction.header_signature,
+                        context_id=batch.header_signature),
+                    context)
+            except Exception as e:  # pylint: disable=broad-except
+                raise _TransactionFailed(
+                    transaction.header_signature, e) from e
+        return context
+
+    def publish_block(self):
+        """Executes every queued batch into a new block.
+        """
+        with self._condition:
+            batches, self._queue = self._queue, []
+
+        if not batches:
+            return
+
+        results = {}
+        for batch in batches:
+            try:
+                context = self._execute_batch(batch)
+                with self._condition:
+                    context.commit()
+                    self._committed_transactions.update(
+                        t.header_signature for t in batch.transactions)
+                results[batch.header_signature] = {'status': COMMITTED}
+            except _TransactionFailed as e:
+                # Anything the handler raises only invalidates its batch;
+                # errors outside the SDK's own point at a handler bug.
+                expected = isinstance(e.cause, (
+                    InvalidTransaction, InternalError, AuthorizationException))
+                LOGGER.log(logging.DEBUG if expected else logging.WARNING,
+                           'Batch %s invalid: %s', batch.header_signature,
+                           e.cause, exc_info=not expected)
+                results[batch.header_signature] = {
+                    'status': INVALID,
+                    'invalid_transactions': [{
+                        'id': e.transaction_id,
+                        'message': str(e.cause),
+                        'extended_data': '',
+                    }],
+                }
+
+        with self._condition:
+            self._block_num += 1
+            self._head = _sha512('{}{}'.format(
+                self._head, ''.join(results)).encode('utf-8'))
+            self._statuses.update(results)
+            self._condition.notify_all()
+
+    def _publish_loop(self):
+        while not self._stopped.wait(self.block_interval):
+            try:
+                self.publish_block()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('Failed to publish block')
+
+    # --- REST API -----------------------------------------------------------
+
+    def _create_app(self):
+        app = Flask(__name__)
+
+        @app.route('/batches', methods=['POST'])
+        def post_batches():
+            return self._post_batches()
+
+        @app.route('/batch_statuses')
+        def get_batch_statuses():
+            return self._get_batch_statuses()
+
+        @app.route('/state')
+        def list_state():
+            return self._list_state()
+
+        @app.route('/state/<address>')
+        def fetch_state(address):
+            return self._fetch_state(address)
+
+        return app
+
+    def _post_batches(self):
+        batch_list = batch_pb2.BatchList()
+        try:
+            batch_list.ParseFromString(request.get_data())
+        except Exception:  # pylint: disable=broad-except
+            return _error('BAD_PROTOBUF',
+                          'Batches must be a serialized BatchList')
+
+        if not batch_list.batches:
+            return _error('NO_BATCHES_SUBMITTED',
+                          'No batches were submitted')
+
+        try:
+            for batch in batch_list.batches:
+                self._validate_batch(batch)
+        except InvalidTransaction as e:
+            return _error('INVALID_BATCH', str(e))
+
+        ids = [batch.header_signature for batch in batch_list.batches]
+        with self._condition:
+            # Batches that are already pending or were already executed are
+            # dropped, as the validator does, so a resubmission cannot run
+            # twice or overwrite the original batch's status.
+            batches = OrderedDict(
+                (batch.header_signature, batch)
+                for batch in batch_list.batches
+                if batch.header_signature not in self._statuses)
+
+            if len(self._queue) + len(batches) > self.max_queue_size:
+                return _error('QUEUE_FULL',
+                              'The validator batch queue is full')
+
+            self._queue.extend(batches.values())
+            for batch_id in batches:
+                self._statuses[batch_id] = {'status': PENDING}
+
+        response = jsonify({'link': '{}/batch_statuses?id={}'.format(
+            request.host_url.rstrip('/'), ','.join(ids))})
+        response.status_code = 202
+        return response
+
+    def _get_batch_statuses(self):
+        ids = [i for i in request.args.get('id', '').split(',') if i]
+        if not ids:
+            return _error('STATUS_ID_QUERY_INVALID',
+                          'Batch statuses require an id query parameter')
+
+        wait = request.args.get('wait', type=float)
+        deadline = time.time() + wait if wait else None
+
+        with self._condition:
+            while deadline is not None and any(
+                    self._status(i)['status'] == PENDING for i in ids):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            data = []
+            for batch_id in ids:
+                status = {'id': batch_id, 'invalid_transactions': []}
+                status.update(self._status(batch_id))
+                data.append(status)
+
+        return jsonify({'data': data, 'link': request.url})
+
+    def _status(self, batch_id):
+        return self._statuses.get(batch_id, {'status': UNKNOWN})
+
+    def _list_state(self):
+        prefix = request.args.get('address', '')
+        limit = request.args.get('limit', DEFAULT_PAGING_LIMIT, type=int)
+        start = request.args.get('start')
+
+        with self._condition:
+            addresses = sorted(
+                a for a in self._state
+                if a.startswith(prefix) and (start is None or a >= start))
+            page = addresses[:limit]
+            data = [{'address': a,
+                     'data': base64.b64encode(self._state[a]).decode()}
+                    for a in page]
+            head = self._head
+
+        paging = {'limit': limit, 'start': start}
+        if len(addresses) > limit:
+            paging['next_position'] = addresses[limit]
+
+        return jsonify(
+            {'data': data, 'head': head, 'link': request.url,
+             'paging': paging})
+
+    def _fetch_state(self, address):
+        with self._condition:
+            data = self._state.get(address)
+            head = self._head
+
+        if data is None:
+            return _error('STATE_NOT_FOUND',
+                          'There is no state data at address {}'.format(
+                              address))
+
+        return jsonify({'data': base64.b64encode(data).decode(),
+                        'head': head, 'link': request.url})
+
+    # --- Lifecycle ----------------------------------------------------------
+
+    def start(self):
+        """Starts serving and publishing blocks on background threads.
+        """
+        self._stopped.clear()
+        self._server = make_server(self.host, self.port, self.app,
+                                   threaded=True)
+        self.port = self._server.server_port
+
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, daemon=True),
+            threading.Thread(target=self._publish_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        '-b', '--bind',
+        default='{}:{}'.format(DEFAULT_HOST, DEFAULT_PORT),
+        help='Host and port to serve the REST API on')
+
+    parser.add_argument(
+        '--block-interval',
+        type=float,
+        default=DEFAULT_BLOCK_INTERVAL,
+        help='Seconds between simulated blocks')
+
+    parser.add_argument(
+        '--max-queue-size',
+        type=int,
+        default=DEFAULT_MAX_QUEUE_SIZE,
+        help='Pending batches accepted before answering QUEUE_FULL')
+
+    parser.add_argument(
+        '--no-verify',
+        action='store_true',
+        help='Skip signature verification of submitted batches')
+
+    parser.add_argument('-v', '--verbose',
+                        action='count',
+                        default=0,
+                        help='Increase output sent to stderr')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+
+    logging.basicConfig(
+        level=logging.DEBUG if opts.verbose > 1 else
+        logging.INFO if opts.verbose else logging.WARNING)
+
+    host, _, port = opts.bind.rpartition(':')
+    emulator = SawtoothEmulator(
+        host=host or DEFAULT_HOST,
+        port=int(port),
+        block_interval=opts.block_interval,
+        max_queue_size=opts.max_queue_size,
+        verify_signatures=not opts.no_verify)
+
+    try:
+        emulator.start()
+        print('Serving the Sawtooth REST API on {}'.format(emulator.url))
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:  # pylint: disable=broad-except
+        print("Error: {}".format(e), file=sys.stderr)
+    finally:
+        emulator.stop()
@@ -20,3 +20,9 @@ class CryptoportCliException(Exception):
 
 class CryptoportClientException(Exception):
     pass
+
+
+class CryptoportBackpressureException(CryptoportClientException):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -0,0 +1,141 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+import io
+import tempfile
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from exceptions import CryptoportClientException
+from handler import DATE_FORMAT
+
+EXPORT_FORMATS = ('arrow', 'parquet')
+
+MIME_TYPES = {
+    'arrow'   : 'application/vnd.apache.arrow.stream',
+    'parquet' : 'application/vnd.apache.parquet',
+}
+
+EXPORT_BATCH_SIZE = 10000
+
+# Parquet output is spooled to disk past this size before being streamed.
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE     = 1024 * 1024
+
+TRANSACTION_SCHEMA = pa.schema([
+    ('name',               pa.string()),
+    ('symbol',             pa.string()),
+    ('type',               pa.int8()),
+    ('amount',             pa.float64()),
+    ('no_of_coins',        pa.float64()),
+    ('price_purchased_at', pa.float64()),
+    ('time_transacted',    pa.date32()),
+    ('time_created',       pa.date32()),
+    ('snapshot',           pa.bool_()),
+])
+
+
+def _to_date(value):
+    try:
+        return datetime.strptime(value, DATE_FORMAT).date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+COLUMN_CONVERTERS = {
+    'name'               : lambda value: value,
+    'symbol'             : lambda value: value,
+    'type'               : _to_int,
+    'amount'             : _to_float,
+    'no_of_coins'        : _to_float,
+    'price_purchased_at' : _to_float,
+    'time_transacted'    : _to_date,
+    'time_created'       : _to_date,
+    'snapshot'           : bool,
+}
+
+
+def record_batches(records, batch_size=EXPORT_BATCH_SIZE):
+    """Builds typed record batches from decoded state records.
+
+    Only one batch worth of columns is materialised at a time.
+    """
+    for start in range(0, len(records), batch_size):
+        chunk   = records[start:start + batch_size]
+        columns = [
+            pa.array([COLUMN_CONVERTERS[field.name](record.get(field.name))
+                      for record in chunk], type=field.type)
+            for field in TRANSACTION_SCHEMA]
+        yield pa.RecordBatch.from_arrays(columns, schema=TRANSACTION_SCHEMA)
+
+
+def _drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def _iter_arrow(records, batch_size):
+    buffer = io.BytesIO()
+    writer = pa.ipc.new_stream(buffer, TRANSACTION_SCHEMA)
+    for batch in record_batches(records, batch_size):
+        writer.write_batch(batch)
+        yield _drain(buffer)
+    writer.close()
+    yield _drain(buffer)
+
+
+def _iter_parquet(records, batch_size):
+    # The Parquet footer refers back to row group offsets, so the file is
+    # written out in full before it can be streamed.
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+        writer = pq.ParquetWriter(spool, TRANSACTION_SCHEMA)
+        for batch in record_batches(records, batch_size):
+            writer.write_table(pa.Table.from_batches([batch]))
+        writer.close()
+
+        spool.seek(0)
+        chunk = spool.read(CHUNK_SIZE)
+        while chunk:
+            yield chunk
+            chunk = spool.read(CHUNK_SIZE)
+
+
+def iter_export(records, fmt='arrow', batch_size=EXPORT_BATCH_SIZE):
+    """Yields the records serialized as Arrow IPC stream or Parquet bytes.
+    """
+    if fmt == 'arrow':
+        return _iter_arrow(records, batch_size)
+    if fmt == 'parquet':
+        return _iter_parquet(records, batch_size)
+
+    raise CryptoportClientException(
+        'Export format must be one of {}'.format(', '.join(EXPORT_FORMATS)))
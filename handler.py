@@ -17,6 +17,7 @@ import logging
 import cbor
 import hashlib
 import json
+from datetime import datetime
 
                 
 from sawtooth_sdk.processor.handler import TransactionHandler
@@ -25,10 +26,21 @@ from sawtooth_sdk.processor.exceptions import InternalError
 
 LOGGER = logging.getLogger(__name__)
 
-VALID_VERBS = 'insert'
+VALID_VERBS = ['insert', 'compact']
 
 MAX_NAME_LENGTH = 20
 
+# Longer than any valid name, so it cannot clash with a name's record list.
+# CryptoportClient.list reads the snapshots back from here.
+SNAPSHOT_KEY = '__cryptoport_snapshot__'
+
+# The format of every date in state. api.new_transaction writes records with
+# it, and the client and exports read them back with it.
+DATE_FORMAT = '%m-%d-%Y'
+
+# Idempotency keys are sha512 hex digests, see tranops.idempotency_digest.
+IDEMPOTENCY_KEY_LENGTH = 128
+
 FAMILY_NAME = 'cryptoport'
 
 CRYPTOPORT_ADDRESS_PREFIX = hashlib.sha512(
@@ -40,6 +52,12 @@ def make_cryptoport_address(name):
         name.encode('utf-8')).hexdigest()[0:64]
 
 
+def make_idempotency_address(key):
+    # Names are limited to MAX_NAME_LENGTH characters, so these addresses
+    # never collide with a name's.
+    return make_cryptoport_address('key:' + key)
+
+
 class CrypoportTransactionHandler(TransactionHandler):
     
     @property
@@ -56,7 +74,10 @@ class CrypoportTransactionHandler(TransactionHandler):
 
     def apply(self, transaction, context):
         
-        verb, name, value = _unpack_transaction(transaction)
+        verb, name, value, key = _unpack_transaction(transaction)
+
+        if key is not None:
+            _check_not_duplicate(key, context)
 
         state = _get_state_data(name, context)
 
@@ -64,19 +85,27 @@ class CrypoportTransactionHandler(TransactionHandler):
 
         _set_state_data(name, updated_state, context)
 
+        if key is not None:
+            _set_idempotency_key(key, transaction.signature, context)
+
 def _unpack_transaction(transaction):
-    verb, name, value = _decode_transaction(transaction)
+    return _unpack_payload(transaction.payload)
+
+
+def _unpack_payload(payload):
+    verb, name, value, key = _decode_payload(payload)
 
     _validate_verb(verb)
     _validate_name(name)
     _validate_value(value)
+    _validate_key(key)
 
-    return verb, name, value
+    return verb, name, value, key
 
 
-def _decode_transaction(transaction):
+def _decode_payload(payload):
     try:
-        content = cbor.loads(transaction.payload)
+        content = cbor.loads(payload)
     except Exception as e:
         raise InvalidTransaction('Invalid payload serialization') from e
 
@@ -95,12 +124,14 @@ def _decode_transaction(transaction):
     except AttributeError:
         raise InvalidTransaction('Value is required') from AttributeError
 
-    return verb, name, value
+    key = content.get('Key')
+
+    return verb, name, value, key
 
 
 def _validate_verb(verb):
     if verb not in VALID_VERBS:
-        raise InvalidTransaction('Verb must be "insert"')
+        raise InvalidTransaction('Verb must be "insert" or "compact"')
 
 def _validate_name(name):
     if not isinstance(name, str) or len(name) > MAX_NAME_LENGTH:
@@ -114,6 +145,27 @@ def _validate_value(value):
     except ValueError as e:
         raise InvalidTransaction('Value must be JSON ')
 
+def _validate_key(key):
+    if key is not None and (not isinstance(key, str) or
+                            len(key) != IDEMPOTENCY_KEY_LENGTH):
+        raise InvalidTransaction(
+            'Key must be a string of {} characters'.format(
+                IDEMPOTENCY_KEY_LENGTH))
+
+def _check_not_duplicate(key, context):
+    # A single read of the key's own address, regardless of history size.
+    entries = context.get_state([make_idempotency_address(key)])
+    if any(entry.data for entry in entries):
+        raise InvalidTransaction(
+            'Duplicate transaction for key {}'.format(key))
+
+def _set_idempotency_key(key, signature, context):
+    addresses = context.set_state(
+        {make_idempotency_address(key): cbor.dumps(signature)})
+
+    if not addresses:
+        raise InternalError('State error')
+
 def _get_state_data(name, context):
     address = make_cryptoport_address(name)
 
@@ -141,6 +193,7 @@ def _do_cryptoport(verb, name, value, state):
     
     verbs = {
         'insert': _do_insert,
+        'compact': _do_compact,
     }
     try:
         return verbs[verb](name, value, state)
@@ -156,3 +209,102 @@ def _do_insert(name, value, state):
     else:
         updated[name].append(value)
     return updated
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, DATE_FORMAT).date()
+    except (TypeError, ValueError):
+        return None
+
+def _number(value):
+    # Records are only checked to be JSON on insert, so amounts may have
+    # been stored as strings.
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+def transacted_before(record, cutoff):
+    """Tells whether compacting at cutoff folds this record.
+
+    CryptoportClient.compact archives records with the same test. Values
+    are only checked to be JSON on insert, so records that are not objects
+    are kept, like records without a parsable date.
+    """
+    if not isinstance(record, dict):
+        return False
+    transacted = _parse_date(record.get('time_transacted'))
+    return transacted is not None and transacted < cutoff
+
+def _do_compact(name, value, state):
+    """Folds records transacted before the cutoff into per-symbol snapshots.
+
+    Only the first `upto` records are considered, the ones the client saw
+    and archived, and `version` must match the current snapshot so that two
+    compactions cannot race.
+    """
+    value    = json.loads(value)
+    if not isinstance(value, dict):
+        raise InvalidTransaction('Compact value must be a JSON object')
+
+    records  = state.get(name, [])
+    snapshot = state.get(SNAPSHOT_KEY) or {
+        'version': 0, 'cutoff': None, 'symbols': {}}
+
+    cutoff = _parse_date(value.get('cutoff'))
+    if cutoff is None:
+        raise InvalidTransaction(
+            'Cutoff must be a date formatted as {}'.format(DATE_FORMAT))
+
+    upto = value.get('upto', len(records))
+    if not isinstance(upto, int) or not 0 <= upto <= len(records):
+        raise InvalidTransaction(
+            'Upto must be between 0 and {}'.format(len(records)))
+
+    if value.get('version', snapshot['version']) != snapshot['version']:
+        raise InvalidTransaction(
+            'Snapshot has moved on to version {}'.format(snapshot['version']))
+
+    symbols = {symbol: dict(entry, types={
+                   t: dict(totals) for t, totals in entry['types'].items()})
+               for symbol, entry in snapshot['symbols'].items()}
+    tail    = []
+    for record in records[:upto]:
+        if transacted_before(record, cutoff):
+            _fold_record(symbols, record)
+        else:
+            tail.append(record)
+
+    previous = _parse_date(snapshot['cutoff'])
+    updated  = dict(state.items())
+    updated[name] = tail + records[upto:]
+    updated[SNAPSHOT_KEY] = {
+        'version': snapshot['version'] + 1,
+        'cutoff': snapshot['cutoff'] if previous and previous > cutoff
+                  else value['cutoff'],
+        'symbols': symbols,
+    }
+    return updated
+
+def _fold_record(symbols, record):
+    symbol = record.get('symbol')
+    entry  = symbols.setdefault(symbol, {
+        'symbol': symbol, 'transactions': 0,
+        'coins': 0, 'total_cost': 0, 'types': {}})
+
+    amount = _number(record.get('amount'))
+    coins  = _number(record.get('no_of_coins'))
+    price  = _number(record.get('price_purchased_at'))
+    sign   = 1 if record.get('type') == 1 else -1
+
+    totals = entry['types'].setdefault(str(record.get('type')), {
+        'amount': 0, 'coins': 0, 'cost': 0})
+    totals['amount'] += amount
+    totals['coins']  += coins
+    totals['cost']   += price * coins
+
+    entry['transactions'] += 1
+    entry['coins']        += sign * coins
+    entry['total_cost']   += sign * amount
@@ -0,0 +1,385 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from collections import defaultdict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cbor
+import yaml
+
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.protobuf import batch_pb2
+from sawtooth_sdk.protobuf import block_pb2
+from sawtooth_sdk.protobuf import transaction_pb2
+
+from handler import FAMILY_NAME
+from handler import CRYPTOPORT_ADDRESS_PREFIX
+from handler import make_cryptoport_address
+from handler import make_idempotency_address
+from handler import _unpack_payload
+from handler import _do_cryptoport
+from handler import _number
+from requestops import send_request
+from exceptions import CryptoportCliException
+
+LOGGER = logging.getLogger(__name__)
+
+# Every record in a dump is a serialized Block (or Batch) prefixed with its
+# length as a 4 byte big-endian unsigned integer.
+RECORD_HEADER = struct.Struct('>I')
+
+DUMP_FORMATS = ['blocks', 'batches']
+
+DEFAULT_CHUNK_SIZE = 64
+
+PROGRESS_INTERVAL = 10
+
+
+def _sha512(data):
+    return hashlib.sha512(data).hexdigest()
+
+
+def read_records(stream):
+    """Yields the length-prefixed records of a dump one at a time.
+    """
+    while True:
+        header = stream.read(RECORD_HEADER.size)
+        if not header:
+            return
+        if len(header) < RECORD_HEADER.size:
+            raise CryptoportCliException('Truncated record header')
+
+        length, = RECORD_HEADER.unpack(header)
+        record = stream.read(length)
+        if len(record) < length:
+            raise CryptoportCliException('Truncated record')
+
+        yield record
+
+
+def _chunked(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _batches_from_record(fmt, record):
+    if fmt == 'blocks':
+        block = block_pb2.Block()
+        block.ParseFromString(record)
+        return block.batches
+
+    batch = batch_pb2.Batch()
+    batch.ParseFromString(record)
+    return [batch]
+
+
+def _decode_batch(batch):
+    """Decodes and validates the cryptoport transactions of a batch.
+
+    Returns None if any of them is invalid, since the validator would have
+    rejected the whole batch.
+    """
+    decoded = []
+    for transaction in batch.transactions:
+        header = transaction_pb2.TransactionHeader()
+        header.ParseFromString(transaction.header)
+        if header.family_name != FAMILY_NAME:
+            continue
+
+        try:
+            decoded.append((transaction.header_signature,) +
+                           _unpack_payload(transaction.payload))
+        except InvalidTransaction as e:
+            LOGGER.debug('Invalid transaction %s: %s',
+                         transaction.header_signature, e)
+            return None
+
+    return decoded
+
+
+def _decode_chunk(fmt, records):
+    # Runs in a worker process: the results are small tuples, so only the
+    # raw records cross the process boundary on the way in.
+    return [_decode_batch(batch)
+            for record in records
+            for batch in _batches_from_record(fmt, record)]
+
+
+class ChainReplay:
+    def __init__(self):
+        self.state = {}
+        self.rollups = defaultdict(lambda: [0, 0])
+
+        self.records = 0
+        self.batches = 0
+        self.invalid_batches = 0
+        self.transactions = 0
+
+    def apply(self, decoded_batches):
+        """Applies decoded batches in chain order.
+        """
+        for decoded in decoded_batches:
+            self.batches += 1
+            if decoded is None:
+                self.invalid_batches += 1
+                continue
+
+            if self._has_duplicate_key(decoded):
+                self.invalid_batches += 1
+                continue
+
+            try:
+                self._apply_batch(decoded)
+            except InvalidTransaction as e:
+                LOGGER.debug('Invalid batch: %s', e)
+                self.invalid_batches += 1
+
+    def _apply_batch(self, decoded):
+        # Compactions can still be rejected at this point, in which case the
+        # batch is kept out of the replayed state and rollups. Writes are
+        # staged, but _do_insert appends to the record list it is given in
+        # place, so the lengths of those lists are remembered and restored.
+        # Copying them instead would make every insert O(history).
+        updates  = {}
+        inserted = []
+        appended = {}
+        try:
+            for signature, verb, name, value, key in decoded:
+                address = make_cryptoport_address(name)
+                state = updates.get(address, self.state.get(address, {}))
+
+                records = state.get(name)
+                if records is not None and id(records) not in appended:
+                    appended[id(records)] = (records, len(records))
+
+                updates[address] = _do_cryptoport(verb, name, value, state)
+
+                if key is not None:
+                    updates[make_idempotency_address(key)] = signature
+
+                if verb == 'insert':
+                    inserted.append(updates[address][name][-1])
+        except InvalidTransaction:
+            for records, length in appended.values():
+                del records[length:]
+            raise
+
+        self.state.update(updates)
+        self.transactions += len(decoded)
+        for record in inserted:
+            self._add_to_rollups(record)
+
+    def _has_duplicate_key(self, decoded):
+        keys = [key for _, _, _, _, key in decoded if key is not None]
+        return len(set(keys)) != len(keys) or any(
+            make_idempotency_address(key) in self.state for key in keys)
+
+    def _add_to_rollups(self, record):
+        # Values are only checked to be JSON, so the chain can hold records
+        # that are not objects, or amounts stored as strings.
+        if not isinstance(record, dict):
+            return
+
+        totals = self.rollups[(record.get('symbol'), record.get('type'))]
+        totals[0] += _number(record.get('amount'))
+        totals[1] += _number(record.get('no_of_coins'))
+
+    def rollup_rows(self):
+        """Returns the rollups in the same shape as CryptoportClient.rollups.
+        """
+        return [[symbol, tran_type, totals[0], totals[1]]
+                for (symbol, tran_type), totals in sorted(
+                    self.rollups.items(), key=lambda item: str(item[0]))]
+
+    def address_hashes(self):
+        return {address: _sha512(cbor.dumps(state))
+                for address, state in self.state.items()}
+
+
+def state_hash(address_hashes):
+    """Hashes the sorted (address, data hash) pairs of the namespace.
+    """
+    digest = hashlib.sha512()
+    for address in sorted(address_hashes):
+        digest.update(address.encode('utf-8'))
+        digest.update(address_hashes[address].encode('utf-8'))
+    return digest.hexdigest()
+
+
+def fetch_address_hashes(url):
+    """Hashes the cryptoport state currently held by a live chain.
+    """
+    address_hashes = {}
+    start = None
+    while True:
+        suffix = 'state?address={}'.format(CRYPTOPORT_ADDRESS_PREFIX)
+        if start is not None:
+            suffix += '&start={}'.format(start)
+
+        result, _ = send_request(url, suffix)
+        response = yaml.safe_load(result)
+
+        for entry in response.get('data', []):
+            address_hashes[entry['address']] = _sha512(
+                base64.b64decode(entry['data']))
+
+        start = response.get('paging', {}).get('next_position')
+        if start is None:
+            return address_hashes
+
+
+def replay(stream, fmt='blocks', workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Replays a dump, decoding chunks of records across a process pool.
+
+    At most two chunks per worker are in flight, so memory use depends on
+    the size of the resulting state rather than on the size of the dump.
+    """
+    workers = workers or os.cpu_count() or 1
+    chain = ChainReplay()
+
+    start_time = time.time()
+    last_report = start_time
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in _chunked(read_records(stream), chunk_size):
+            chain.records += len(chunk)
+            pending.append(executor.submit(_decode_chunk, fmt, chunk))
+
+            if len(pending) >= workers * 2:
+                chain.apply(pending.popleft().result())
+
+            if time.time() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.time()
+                LOGGER.info('Replayed %s transactions (%.0f/s)',
+                            chain.transactions,
+                            chain.transactions / (last_report - start_time))
+
+        while pending:
+            chain.apply(pending.popleft().result())
+
+    return chain, time.time() - start_time
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        'dump',
+        help='Length-prefixed block or batch export, or - for stdin')
+
+    parser.add_argument(
+        '-f', '--format',
+        choices=DUMP_FORMATS,
+        default='blocks',
+        help='Type of the records in the dump')
+
+    parser.add_argument(
+        '-o', '--output',
+        help='File to write the resulting state, rollups and hashes to')
+
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=None,
+        help='Number of decoding processes (default: number of CPUs)')
+
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help='Number of records handed to a worker at a time')
+
+    parser.add_argument(
+        '--url',
+        default=None,
+        help='REST API of a live chain to compare the state hash with')
+
+    parser.add_argument('-v', '--verbose',
+                        action='count',
+                        default=0,
+                        help='Increase output sent to stderr')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+
+    logging.basicConfig(
+        level=logging.DEBUG if opts.verbose > 1 else
+        logging.INFO if opts.verbose else logging.WARNING)
+
+    try:
+        if opts.dump == '-':
+            chain, elapsed = replay(sys.stdin.buffer, opts.format,
+                                    opts.workers, opts.chunk_size)
+        else:
+            with open(opts.dump, 'rb') as fd:
+                chain, elapsed = replay(fd, opts.format,
+                                        opts.workers, opts.chunk_size)
+
+        address_hashes = chain.address_hashes()
+        replayed_hash = state_hash(address_hashes)
+
+        print('records            = {}'.format(chain.records))
+        print('batches            = {}'.format(chain.batches))
+        print('invalid batches    = {}'.format(chain.invalid_batches))
+        print('transactions       = {}'.format(chain.transactions))
+        print('elapsed            = {:.2f}s'.format(elapsed))
+        print('transactions/s     = {:.0f}'.format(
+            chain.transactions / elapsed if elapsed else 0))
+        print('state hash         = {}'.format(replayed_hash))
+
+        if opts.output is not None:
+            with open(opts.output, 'w') as fd:
+                json.dump({
+                    'state_hash': replayed_hash,
+                    'address_hashes': address_hashes,
+                    'rollups': chain.rollup_rows(),
+                    'state': chain.state,
+                }, fd)
+
+        if opts.url is not None:
+            live_hash = state_hash(fetch_address_hashes(opts.url))
+            print('live state hash    = {}'.format(live_hash))
+            if live_hash != replayed_hash:
+                print('Error: replayed state does not match the live chain',
+                      file=sys.stderr)
+                sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:  # pylint: disable=broad-except
+        print("Error: {}".format(e), file=sys.stderr)
+        sys.exit(1)
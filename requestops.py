@@ -14,6 +14,18 @@
 # ------------------------------------------------------------------------------
 import requests
 from exceptions import CryptoportClientException
+from exceptions import CryptoportBackpressureException
+
+# Status codes the REST API uses to push back on submissions, e.g. 429 when
+# the validator's batch queue is full (QUEUE_FULL).
+BACKPRESSURE_STATUS_CODES = (429, 503)
+
+
+def _retry_after(result):
+    try:
+        return float(result.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
 
 def send_request(url, suffix, data=None, 
                  content_type=None, name=None):
@@ -33,6 +45,11 @@ def send_request(url, suffix, data=None,
         else:
             result = requests.get(url, headers=headers)
 
+        if result.status_code in BACKPRESSURE_STATUS_CODES:
+            raise CryptoportBackpressureException(
+                "Error {}: {}".format(result.status_code, result.reason),
+                retry_after=_retry_after(result))
+
         if not result.ok and not result.status_code == 404:
             raise CryptoportClientException("Error {}: {}".format(
                 result.status_code, result.reason))
@@ -41,6 +58,9 @@ def send_request(url, suffix, data=None,
         raise CryptoportClientException(
             'Failed to connect to REST API: {}'.format(err)) from err
 
+    except CryptoportClientException:
+        raise
+
     except BaseException as err:
         raise CryptoportClientException(err) from err
     
@@ -0,0 +1,92 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import threading
+
+from admission import IdempotencyCache, SubmissionGate, IN_FLIGHT
+from exceptions import CryptoportBackpressureException
+
+
+def _take_slot(gate):
+    # Slots are re-entrant per thread, so contention needs a second thread.
+    errors = []
+
+    def take():
+        try:
+            with gate.slot():
+                pass
+        except CryptoportBackpressureException as err:
+            errors.append(err)
+
+    thread = threading.Thread(target=take)
+    thread.start()
+    thread.join()
+    return errors
+
+
+def test_gate_sheds_over_the_cap():
+    gate = SubmissionGate(max_in_flight=1)
+
+    with gate.slot():
+        errors = _take_slot(gate)
+
+    assert len(errors) == 1
+    assert errors[0].retry_after is not None
+    assert gate.snapshot()['shed'] == 1
+    assert gate.snapshot()['in_flight'] == 0
+    assert _take_slot(gate) == []
+
+
+def test_nested_slots_on_one_thread_count_once():
+    gate = SubmissionGate(max_in_flight=1)
+
+    with gate.slot():
+        with gate.slot():
+            assert gate.snapshot()['in_flight'] == 1
+        assert gate.snapshot()['in_flight'] == 1
+
+    assert gate.snapshot()['in_flight'] == 0
+    assert gate.snapshot()['shed'] == 0
+
+    with gate.slot():
+        pass
+
+
+def test_reservation_blocks_concurrent_submissions():
+    cache = IdempotencyCache()
+
+    assert cache.reserve('key') is None
+    assert cache.reserve('key') is IN_FLIGHT
+
+    cache.put('key', 'txn')
+    assert cache.reserve('key') == 'txn'
+
+
+def test_released_reservation_can_be_retried():
+    cache = IdempotencyCache()
+
+    assert cache.reserve('key') is None
+    cache.release('key')
+
+    assert cache.reserve('key') is None
+
+
+def test_release_keeps_completed_results():
+    cache = IdempotencyCache()
+    cache.put('key', 'txn')
+
+    cache.release('key')
+
+    assert cache.reserve('key') == 'txn'
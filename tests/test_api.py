@@ -0,0 +1,168 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import api
+from admission import IdempotencyCache, SubmissionGate
+from exceptions import CryptoportClientException
+from exportops import MIME_TYPES, iter_export
+
+TRANSACTION = {
+    "name": "Bitcoin",
+    "symbol": "BTC",
+    "type": 1,
+    "amount": 1000,
+    "time_transacted": 1577836800,
+    "time_created": 1577836800,
+    "price_purchased_at": 10.0,
+    "no_of_coins": 1.0,
+}
+
+
+class _Client:
+    def __init__(self):
+        self.inserted = []
+        self.before_insert = None
+        self.records = []
+
+    def insert(self, value, wait=None, idempotency_key=None):
+        if self.before_insert is not None:
+            self.before_insert()
+        self.inserted.append((value, idempotency_key))
+        return "txn-{}".format(len(self.inserted))
+
+    def export(self, sink=None, fmt="arrow"):
+        return iter_export(self.records, fmt)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = _Client()
+    monkeypatch.setattr(api, "_get_client", lambda args, read_key_file: fake)
+    return fake
+
+
+def test_full_gate_sheds_before_signing(monkeypatch):
+    gate = SubmissionGate(max_in_flight=0)
+    monkeypatch.setattr(api, "SUBMISSIONS", gate)
+
+    def _no_client(args, read_key_file):
+        raise AssertionError("client built while shedding")
+    monkeypatch.setattr(api, "_get_client", _no_client)
+
+    response = api.app.test_client().post("/transactions", json=TRANSACTION)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert gate.snapshot()["shed"] == 1
+
+
+def test_insert_holds_a_slot(client, monkeypatch):
+    gate = SubmissionGate(max_in_flight=1)
+    monkeypatch.setattr(api, "SUBMISSIONS", gate)
+
+    seen = []
+    insert = client.insert
+
+    def _insert(*args, **kwargs):
+        seen.append(gate.snapshot()["in_flight"])
+        return insert(*args, **kwargs)
+    monkeypatch.setattr(client, "insert", _insert)
+
+    response = api.app.test_client().post("/transactions", json=TRANSACTION)
+
+    assert response.status_code == 200
+    assert seen == [1]
+    assert gate.snapshot()["in_flight"] == 0
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    cache = IdempotencyCache()
+    monkeypatch.setattr(api, "SUBMITTED_KEYS", cache)
+    return cache
+
+
+def _post(key):
+    return api.app.test_client().post(
+        "/transactions", json=TRANSACTION, headers={"Idempotency-Key": key})
+
+
+def test_retry_returns_original_id_without_resubmitting(client, keys):
+    first = _post("k1")
+    second = _post("k1")
+
+    assert first.get_json()["id"] == second.get_json()["id"] == "txn-1"
+    assert len(client.inserted) == 1
+    assert client.inserted[0][1] == "k1"
+
+
+def test_concurrent_retry_gets_conflict(client, keys):
+    retries = []
+    client.before_insert = lambda: retries.append(_post("k1"))
+
+    first = _post("k1")
+
+    assert first.status_code == 200
+    assert retries[0].status_code == 409
+    assert "Retry-After" in retries[0].headers
+    assert len(client.inserted) == 1
+
+
+def test_failed_submission_releases_key(client, keys):
+    def _fail():
+        raise CryptoportClientException("boom")
+    client.before_insert = _fail
+
+    assert _post("k1").status_code == 500
+
+    client.before_insert = None
+    assert _post("k1").get_json()["id"] == "txn-1"
+
+
+def _export(query=""):
+    return api.app.test_client().get("/transactions/export" + query)
+
+
+def test_export_defaults_to_an_arrow_stream(client):
+    client.records = [{"symbol": "BTC", "type": 1,
+                       "time_transacted": "01-31-2020"}]
+
+    response = _export()
+
+    assert response.status_code == 200
+    assert response.mimetype == MIME_TYPES["arrow"]
+    table = pa.ipc.open_stream(response.data).read_all()
+    assert table.column("symbol").to_pylist() == ["BTC"]
+    assert table.column("time_transacted").type == pa.date32()
+
+
+def test_export_parquet_is_an_attachment(client):
+    response = _export("?format=parquet")
+
+    assert response.status_code == 200
+    assert response.mimetype == MIME_TYPES["parquet"]
+    assert "transactions.parquet" in response.headers["Content-Disposition"]
+    assert pq.read_table(pa.BufferReader(response.data)).num_rows == 0
+
+
+def test_export_rejects_an_unknown_format(client):
+    response = _export("?format=csv")
+
+    assert response.status_code == 400
+    assert "arrow" in response.get_json()["error"]
@@ -0,0 +1,202 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import hashlib
+import io
+import json
+
+import cbor
+import pyarrow.parquet as pq
+import pytest
+
+from sawtooth_signing import create_context
+from sawtooth_signing import CryptoFactory
+from sawtooth_signing.secp256k1 import Secp256k1PrivateKey
+
+from cryptoport_client import CryptoportClient
+from emulator import SawtoothEmulator
+from exceptions import CryptoportClientException
+from handler import SNAPSHOT_KEY, make_cryptoport_address, _do_cryptoport
+from tranops import CryptoPort, idempotency_digest
+
+RECORD = {
+    'name': 'Bitcoin',
+    'symbol': 'BTC',
+    'type': 1,
+    'amount': 1000,
+    'time_transacted': '01-01-2020',
+    'time_created': '01-01-2020',
+    'price_purchased_at': 10.0,
+    'no_of_coins': 1.0,
+}
+
+
+def _transaction_id(client, idempotency_key):
+    signer = client._signer_for(RECORD, idempotency_key)
+    transaction, = CryptoPort.create_cryptoport_transactions(
+        'insert', 'name', RECORD, signer, idempotency_key=idempotency_key)
+    return transaction.header_signature
+
+
+def _client(signing_secret='secret'):
+    return CryptoportClient(url='http://127.0.0.1:8008',
+                            signing_secret=signing_secret)
+
+
+def test_keyed_insert_id_is_the_same_across_clients():
+    first = _client()
+    second = _client()
+
+    assert _transaction_id(first, 'k1') == _transaction_id(second, 'k1')
+    assert _transaction_id(first, 'k1') != _transaction_id(first, 'k2')
+
+
+def test_signing_key_depends_on_the_secret():
+    # The digest is published on chain as the payload Key, so it must not
+    # be enough to derive the signing key.
+    digest = idempotency_digest('k1', RECORD)
+    public_key = _client()._signer_for(RECORD, 'k1').get_public_key()
+
+    assert public_key.as_hex() != _client('other')._signer_for(
+        RECORD, 'k1').get_public_key().as_hex()
+    from_digest = CryptoFactory(create_context('secp256k1')).new_signer(
+        Secp256k1PrivateKey.from_hex(
+            hashlib.sha256(digest.encode('utf-8')).hexdigest()))
+    assert public_key.as_hex() != from_digest.get_public_key().as_hex()
+
+
+def test_unkeyed_insert_uses_the_client_key():
+    client = _client()
+
+    assert client._signer_for(RECORD, None) is client._signer
+
+
+def test_keyed_insert_without_a_secret_uses_the_client_key():
+    client = _client(signing_secret=None)
+
+    assert client._signer_for(RECORD, 'k1') is client._signer
+
+
+def test_insert_returns_the_transaction_id(monkeypatch):
+    sent = []
+    monkeypatch.setattr(
+        CryptoPort, 'send_transaction',
+        lambda self, url, batch_list, wait=None: sent.append(batch_list))
+    client = _client()
+
+    transaction_id = client.insert(RECORD, idempotency_key='k1')
+
+    assert transaction_id == _transaction_id(client, 'k1')
+    assert sent[0].batches[0].transactions[0].header_signature == \
+        transaction_id
+
+
+def _client_with_state(monkeypatch, state):
+    client = CryptoportClient(url='http://127.0.0.1:8008')
+    monkeypatch.setattr(client, '_get_state_data', lambda: state)
+    return client
+
+
+def test_list_and_rollups_combine_snapshot_and_tail(monkeypatch):
+    records = [
+        dict(RECORD, time_transacted='01-01-2020'),
+        dict(RECORD, type=0, amount=400, no_of_coins=0.5,
+             time_transacted='02-01-2020'),
+        dict(RECORD, symbol='ETH', amount=300, no_of_coins=3.0,
+             time_transacted='01-01-2022'),
+        dict(RECORD, time_transacted='03-01-2022'),
+    ]
+    state = {}
+    for record in records:
+        state = _do_cryptoport('insert', 'name', json.dumps(record), state)
+    compacted = _do_cryptoport('compact', 'name', json.dumps(
+        {'cutoff': '01-01-2021', 'version': 0}), state)
+
+    plain = _client_with_state(monkeypatch, state)
+    client = _client_with_state(monkeypatch, compacted)
+
+    listed = client.list()
+    assert [r.get('snapshot', False) for r in listed] == [
+        True, True, False, False]
+    assert listed[2:] == records[2:]
+
+    assert sorted(client.rollups()) == sorted(plain.rollups())
+
+
+def test_list_without_snapshot_is_unchanged(monkeypatch):
+    state = {'name': [RECORD]}
+
+    assert _client_with_state(monkeypatch, state).list() == [RECORD]
+
+
+HISTORY = [
+    dict(RECORD, time_transacted='01-01-2020'),
+    dict(RECORD, symbol='ETH', time_transacted='01-01-2022'),
+]
+
+
+@pytest.fixture
+def emulator():
+    with SawtoothEmulator(port=0, block_interval=0.05) as emulator:
+        emulator.load_state({make_cryptoport_address('name'): cbor.dumps(
+            {'name': HISTORY})})
+        yield emulator
+
+
+def test_compact_requires_an_archive(monkeypatch):
+    client = _client_with_state(monkeypatch, {'name': HISTORY})
+
+    with pytest.raises(CryptoportClientException, match='archive'):
+        client.compact('01-01-2021', None)
+
+
+def test_compact_archives_and_waits_for_the_commit(emulator):
+    client = CryptoportClient(url=emulator.url)
+    archive = io.BytesIO()
+
+    assert client.compact('01-01-2021', archive, wait=5)
+
+    archive.seek(0)
+    assert pq.read_table(archive).column('symbol').to_pylist() == ['BTC']
+    listed = client.list()
+    assert [r.get('snapshot', False) for r in listed] == [True, False]
+    assert listed[1] == HISTORY[1]
+
+
+def test_rejected_compaction_is_reported(emulator, monkeypatch):
+    client = CryptoportClient(url=emulator.url)
+    get_state_data = client._get_state_data
+
+    def _stale():
+        data = get_state_data()
+        data[SNAPSHOT_KEY] = {'version': 3, 'cutoff': None, 'symbols': {}}
+        return data
+    monkeypatch.setattr(client, '_get_state_data', _stale)
+
+    with pytest.raises(CryptoportClientException, match='invalid: .*version'):
+        client.compact('01-01-2021', io.BytesIO(), wait=5)
+
+    assert CryptoportClient(url=emulator.url).list() == HISTORY
+
+
+def test_compaction_still_pending_is_reported(monkeypatch):
+    client = _client_with_state(monkeypatch, {'name': HISTORY})
+    monkeypatch.setattr(CryptoPort, 'send_transaction',
+                        lambda self, url, batch_list, wait=None: None)
+    monkeypatch.setattr(client, '_batch_status',
+                        lambda batch_id, wait: {'status': 'PENDING'})
+
+    with pytest.raises(CryptoportClientException, match='pending'):
+        client.compact('01-01-2021', io.BytesIO())
@@ -0,0 +1,127 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import hashlib
+import json
+
+import cbor
+
+from sawtooth_sdk.protobuf import batch_pb2
+from sawtooth_sdk.protobuf import transaction_pb2
+
+from emulator import SawtoothEmulator, COMMITTED, INVALID
+from handler import CRYPTOPORT_ADDRESS_PREFIX, FAMILY_NAME
+
+
+def _transaction(transaction_id, content):
+    payload = cbor.dumps(content)
+    header = transaction_pb2.TransactionHeader(
+        family_name=FAMILY_NAME,
+        family_version='1.0',
+        inputs=[CRYPTOPORT_ADDRESS_PREFIX],
+        outputs=[CRYPTOPORT_ADDRESS_PREFIX],
+        payload_sha512=hashlib.sha512(payload).hexdigest())
+    return transaction_pb2.Transaction(
+        header=header.SerializeToString(),
+        header_signature=transaction_id,
+        payload=payload)
+
+
+def _batch(batch_id, *transactions):
+    header = batch_pb2.BatchHeader(
+        transaction_ids=[t.header_signature for t in transactions])
+    return batch_pb2.Batch(
+        header=header.SerializeToString(),
+        header_signature=batch_id,
+        transactions=list(transactions))
+
+
+def _post(emulator, *batches):
+    return emulator.app.test_client().post(
+        '/batches',
+        data=batch_pb2.BatchList(batches=list(batches)).SerializeToString())
+
+
+def _records(emulator):
+    return cbor.loads(next(iter(emulator._state.values())))['name']
+
+
+def _insert(transaction_id):
+    return _transaction(transaction_id, {
+        'Verb': 'insert', 'Name': 'name',
+        'Value': json.dumps({'symbol': 'BTC', 'type': 1})})
+
+
+def test_malformed_payload_only_invalidates_its_batch():
+    emulator = SawtoothEmulator(verify_signatures=False)
+    emulator._queue = [
+        _batch('bad', _insert('ok-1'), _transaction('no-verb', {
+            'Name': 'name', 'Value': '{}'})),
+        _batch('good', _insert('ok-2')),
+    ]
+
+    emulator.publish_block()
+
+    bad = emulator._status('bad')
+    assert bad['status'] == INVALID
+    assert bad['invalid_transactions'][0]['id'] == 'no-verb'
+    assert emulator._status('good')['status'] == COMMITTED
+
+    assert len(_records(emulator)) == 1
+
+
+def test_publishing_continues_after_a_bad_block():
+    emulator = SawtoothEmulator(verify_signatures=False)
+    emulator._queue = [_batch('bad', _transaction('bad-value', {
+        'Verb': 'insert', 'Name': 'name', 'Value': 42}))]
+    emulator.publish_block()
+
+    emulator._queue = [_batch('good', _insert('ok'))]
+    emulator.publish_block()
+
+    assert emulator._status('bad')['status'] == INVALID
+    assert emulator._status('good')['status'] == COMMITTED
+
+
+def test_resubmitted_batch_is_only_executed_once():
+    emulator = SawtoothEmulator(verify_signatures=False)
+    batch = _batch('batch', _insert('ok'))
+
+    assert _post(emulator, batch).status_code == 202
+    assert _post(emulator, batch, batch).status_code == 202
+    assert emulator.queue_size == 1
+    emulator.publish_block()
+
+    assert _post(emulator, batch).status_code == 202
+    assert emulator.queue_size == 0
+    emulator.publish_block()
+
+    assert emulator._status('batch')['status'] == COMMITTED
+    assert len(_records(emulator)) == 1
+
+
+def test_committed_transaction_in_a_new_batch_is_invalid():
+    emulator = SawtoothEmulator(verify_signatures=False)
+    _post(emulator, _batch('first', _insert('ok')))
+    emulator.publish_block()
+
+    _post(emulator, _batch('second', _insert('ok')))
+    emulator.publish_block()
+
+    assert emulator._status('first')['status'] == COMMITTED
+    second = emulator._status('second')
+    assert second['status'] == INVALID
+    assert second['invalid_transactions'][0]['id'] == 'ok'
+    assert len(_records(emulator)) == 1
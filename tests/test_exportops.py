@@ -0,0 +1,130 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import io
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from cryptoport_client import CryptoportClient
+from exceptions import CryptoportClientException
+from exportops import TRANSACTION_SCHEMA, iter_export
+
+RECORDS = [
+    {'name': 'Bitcoin', 'symbol': 'BTC', 'type': 1, 'amount': 1000,
+     'no_of_coins': 1.0, 'price_purchased_at': 10.0,
+     'time_transacted': '01-31-2020', 'time_created': '02-01-2020'},
+    {'name': 'Ether', 'symbol': 'ETH', 'type': '0', 'amount': '250.5',
+     'no_of_coins': 2, 'price_purchased_at': None,
+     'time_transacted': '2020-01-31', 'time_created': 1577836800},
+    {'name': 'Solana', 'symbol': 'SOL', 'type': 1, 'amount': 5,
+     'no_of_coins': 0.5, 'price_purchased_at': 10.0,
+     'time_transacted': '12-25-2021', 'time_created': '12-25-2021',
+     'snapshot': True},
+]
+
+
+def _read_arrow(chunks):
+    return pa.ipc.open_stream(b''.join(chunks)).read_all()
+
+
+def _read_parquet(chunks):
+    return pq.ParquetFile(io.BytesIO(b''.join(chunks)))
+
+
+def test_arrow_export_has_the_typed_schema():
+    table = _read_arrow(iter_export(RECORDS, 'arrow'))
+
+    assert table.schema == TRANSACTION_SCHEMA
+    assert table.schema.field('type').type == pa.int8()
+    assert table.schema.field('time_transacted').type == pa.date32()
+
+    rows = table.to_pylist()
+    assert rows[0]['time_transacted'] == date(2020, 1, 31)
+    assert rows[0]['time_created'] == date(2020, 2, 1)
+    assert rows[1]['type'] == 0
+    assert rows[1]['amount'] == 250.5
+    assert rows[1]['price_purchased_at'] is None
+    assert [row['snapshot'] for row in rows] == [False, False, True]
+
+
+def test_unparsable_dates_are_null():
+    rows = _read_arrow(iter_export(RECORDS, 'arrow')).to_pylist()
+
+    assert rows[1]['time_transacted'] is None
+    assert rows[1]['time_created'] is None
+
+
+def test_parquet_export_reads_back_the_same_table():
+    parquet = _read_parquet(iter_export(RECORDS, 'parquet')).read()
+
+    assert parquet.schema.remove_metadata() == TRANSACTION_SCHEMA
+    assert parquet.to_pylist() == \
+        _read_arrow(iter_export(RECORDS, 'arrow')).to_pylist()
+
+
+def test_arrow_export_is_written_batch_by_batch():
+    records = RECORDS * 5
+    reader = pa.ipc.open_stream(b''.join(
+        iter_export(records, 'arrow', batch_size=4)))
+
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [4, 4, 4, 3]
+    assert pa.Table.from_batches(batches).column('symbol').to_pylist() == \
+        [record['symbol'] for record in records]
+
+
+def test_parquet_export_has_a_row_group_per_batch():
+    parquet = _read_parquet(iter_export(RECORDS * 5, 'parquet',
+                                        batch_size=4))
+
+    assert parquet.num_row_groups == 4
+    assert parquet.metadata.num_rows == 15
+
+
+@pytest.mark.parametrize('fmt', ['arrow', 'parquet'])
+def test_empty_portfolio_exports_an_empty_table(fmt):
+    chunks = list(iter_export([], fmt))
+    table = _read_arrow(chunks) if fmt == 'arrow' else \
+        _read_parquet(chunks).read()
+
+    assert table.num_rows == 0
+    assert table.schema.remove_metadata() == TRANSACTION_SCHEMA
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(CryptoportClientException):
+        iter_export(RECORDS, 'csv')
+
+
+def test_client_export_writes_to_a_sink(monkeypatch):
+    client = CryptoportClient(url='http://127.0.0.1:8008')
+    monkeypatch.setattr(client, '_get_state_data',
+                        lambda: {'name': RECORDS[:2]})
+    sink = io.BytesIO()
+
+    client.export(sink, fmt='parquet')
+
+    sink.seek(0)
+    assert pq.read_table(sink).column('symbol').to_pylist() == ['BTC', 'ETH']
+
+
+def test_client_export_of_an_empty_portfolio(monkeypatch):
+    client = CryptoportClient(url='http://127.0.0.1:8008')
+    monkeypatch.setattr(client, '_get_state_data', lambda: None)
+
+    assert _read_arrow(client.export()).num_rows == 0
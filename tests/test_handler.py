@@ -0,0 +1,256 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import hashlib
+import json
+
+import cbor
+import pytest
+
+from sawtooth_sdk.processor.exceptions import InternalError
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.protobuf import processor_pb2
+from sawtooth_sdk.protobuf import state_context_pb2
+
+from handler import CrypoportTransactionHandler
+from handler import SNAPSHOT_KEY
+from handler import make_cryptoport_address
+from handler import make_idempotency_address
+from handler import _check_not_duplicate
+from handler import _do_cryptoport
+from handler import _set_idempotency_key
+from handler import _validate_verb
+
+KEY = hashlib.sha512(b'retry').hexdigest()
+
+RECORDS = [
+    {'symbol': 'BTC', 'type': 1, 'amount': 1000, 'no_of_coins': 1.0,
+     'price_purchased_at': 10.0, 'time_transacted': '01-05-2020'},
+    {'symbol': 'BTC', 'type': 0, 'amount': 500, 'no_of_coins': 0.5,
+     'price_purchased_at': 12.0, 'time_transacted': '02-05-2020'},
+    {'symbol': 'ETH', 'type': 1, 'amount': 300, 'no_of_coins': 3.0,
+     'price_purchased_at': 1.0, 'time_transacted': '06-05-2021'},
+]
+
+
+def _state(records=RECORDS):
+    state = {}
+    for record in records:
+        state = _do_cryptoport('insert', 'name', json.dumps(record), state)
+    return state
+
+
+def _compact(state, **value):
+    return _do_cryptoport('compact', 'name', json.dumps(value), state)
+
+
+def test_compact_folds_records_before_the_cutoff():
+    state = _compact(_state(), cutoff='01-01-2021', version=0)
+
+    assert state['name'] == [RECORDS[2]]
+
+    snapshot = state[SNAPSHOT_KEY]
+    assert snapshot['version'] == 1
+    assert snapshot['cutoff'] == '01-01-2021'
+    assert list(snapshot['symbols']) == ['BTC']
+
+    btc = snapshot['symbols']['BTC']
+    assert btc['transactions'] == 2
+    assert btc['coins'] == 0.5
+    assert btc['total_cost'] == 500
+    assert btc['types']['1'] == {'amount': 1000, 'coins': 1.0, 'cost': 10.0}
+    assert btc['types']['0'] == {'amount': 500, 'coins': 0.5, 'cost': 6.0}
+
+
+def test_compact_keeps_records_on_or_after_the_cutoff():
+    state = _compact(_state(), cutoff='01-05-2020', version=0)
+
+    assert state['name'] == RECORDS
+    assert state[SNAPSHOT_KEY]['symbols'] == {}
+
+
+def test_compact_keeps_records_with_unparsable_dates():
+    undated = dict(RECORDS[0], time_transacted='yesterday')
+    state = _compact(_state([undated]), cutoff='01-01-2030')
+
+    assert state['name'] == [undated]
+
+
+def test_compact_keeps_records_that_are_not_objects():
+    state = _do_cryptoport('insert', 'name', '5', _state())
+    state = _do_cryptoport('insert', 'name', '"BTC"', state)
+
+    state = _compact(state, cutoff='01-01-2021', version=0)
+
+    assert state['name'] == [RECORDS[2], 5, 'BTC']
+    assert state[SNAPSHOT_KEY]['symbols']['BTC']['transactions'] == 2
+
+
+def test_repeated_compaction_adds_to_the_snapshot():
+    state = _compact(_state(), cutoff='01-01-2021', version=0)
+    state = _compact(state, cutoff='01-01-2022', version=1)
+
+    assert state['name'] == []
+    assert state[SNAPSHOT_KEY]['version'] == 2
+    assert state[SNAPSHOT_KEY]['cutoff'] == '01-01-2022'
+    assert state[SNAPSHOT_KEY]['symbols']['BTC']['transactions'] == 2
+    assert state[SNAPSHOT_KEY]['symbols']['ETH']['coins'] == 3.0
+
+
+def test_earlier_cutoff_does_not_move_snapshot_back():
+    state = _compact(_state(), cutoff='01-01-2021', version=0)
+    state = _compact(state, cutoff='01-01-2019', version=1)
+
+    assert state[SNAPSHOT_KEY]['cutoff'] == '01-01-2021'
+
+
+def test_compact_does_not_change_the_previous_state():
+    before = _compact(_state(), cutoff='01-01-2021', version=0)
+    snapshot = json.dumps(before[SNAPSHOT_KEY], sort_keys=True)
+
+    _compact(before, cutoff='01-01-2022', version=1)
+
+    assert json.dumps(before[SNAPSHOT_KEY], sort_keys=True) == snapshot
+    assert before['name'] == [RECORDS[2]]
+
+
+def test_stale_version_is_rejected():
+    state = _compact(_state(), cutoff='01-01-2021', version=0)
+
+    with pytest.raises(InvalidTransaction):
+        _compact(state, cutoff='01-01-2022', version=0)
+
+
+def test_upto_limits_the_records_considered():
+    state = _compact(_state(), cutoff='01-01-2021', upto=1, version=0)
+
+    assert state['name'] == RECORDS[1:]
+    assert state[SNAPSHOT_KEY]['symbols']['BTC']['transactions'] == 1
+
+
+@pytest.mark.parametrize('upto', [-1, len(RECORDS) + 1, '2', 1.5])
+def test_upto_out_of_bounds_is_rejected(upto):
+    with pytest.raises(InvalidTransaction):
+        _compact(_state(), cutoff='01-01-2021', upto=upto, version=0)
+
+
+@pytest.mark.parametrize('cutoff', [None, '2021-01-01', 20210101])
+def test_invalid_cutoff_is_rejected(cutoff):
+    with pytest.raises(InvalidTransaction):
+        _compact(_state(), cutoff=cutoff, version=0)
+
+
+def test_compact_value_must_be_an_object():
+    with pytest.raises(InvalidTransaction):
+        _do_cryptoport('compact', 'name', json.dumps([]), _state())
+
+
+@pytest.mark.parametrize('verb', ['ins', 'compac', ''])
+def test_partial_verbs_are_rejected(verb):
+    with pytest.raises(InvalidTransaction):
+        _validate_verb(verb)
+
+
+class _Context:
+    def __init__(self, state=None):
+        self.state = dict(state or {})
+
+    def get_state(self, addresses, timeout=None):
+        return [state_context_pb2.TpStateEntry(
+                    address=address, data=self.state[address])
+                for address in addresses if address in self.state]
+
+    def set_state(self, entries, timeout=None):
+        self.state.update(entries)
+        return list(entries)
+
+
+def _request(signature, key=None, name='name'):
+    content = {'Verb': 'insert', 'Name': name, 'Value': json.dumps(RECORDS[0])}
+    if key is not None:
+        content['Key'] = key
+    return processor_pb2.TpProcessRequest(
+        payload=cbor.dumps(content), signature=signature)
+
+
+def _records(context, name='name'):
+    return cbor.loads(context.state[make_cryptoport_address(name)])[name]
+
+
+def test_unseen_key_is_not_a_duplicate():
+    _check_not_duplicate(KEY, _Context())
+
+
+def test_empty_key_entry_is_not_a_duplicate():
+    _check_not_duplicate(KEY, _Context({make_idempotency_address(KEY): b''}))
+
+
+def test_set_key_makes_it_a_duplicate():
+    context = _Context()
+
+    _set_idempotency_key(KEY, 't1', context)
+
+    assert cbor.loads(context.state[make_idempotency_address(KEY)]) == 't1'
+    with pytest.raises(InvalidTransaction):
+        _check_not_duplicate(KEY, context)
+
+
+def test_set_key_fails_when_state_is_not_written():
+    class _Unwritable(_Context):
+        def set_state(self, entries, timeout=None):
+            return []
+
+    with pytest.raises(InternalError):
+        _set_idempotency_key(KEY, 't1', _Unwritable())
+
+
+def test_apply_rejects_a_second_transaction_with_the_same_key():
+    handler = CrypoportTransactionHandler()
+    context = _Context()
+
+    handler.apply(_request('t1', KEY), context)
+    with pytest.raises(InvalidTransaction):
+        handler.apply(_request('t2', KEY), context)
+
+    assert _records(context) == [RECORDS[0]]
+    assert cbor.loads(context.state[make_idempotency_address(KEY)]) == 't1'
+
+
+def test_key_applies_across_names():
+    handler = CrypoportTransactionHandler()
+    context = _Context()
+
+    handler.apply(_request('t1', KEY), context)
+    with pytest.raises(InvalidTransaction):
+        handler.apply(_request('t2', KEY, name='other'), context)
+
+    assert make_cryptoport_address('other') not in context.state
+
+
+def test_apply_without_a_key_is_not_deduplicated():
+    handler = CrypoportTransactionHandler()
+    context = _Context()
+
+    handler.apply(_request('t1'), context)
+    handler.apply(_request('t2'), context)
+
+    assert _records(context) == [RECORDS[0], RECORDS[0]]
+    assert len(context.state) == 1
+
+
+@pytest.mark.parametrize('key', ['short', 42, KEY + 'a'])
+def test_malformed_key_is_rejected(key):
+    with pytest.raises(InvalidTransaction):
+        CrypoportTransactionHandler().apply(_request('t1', key), _Context())
@@ -0,0 +1,245 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import hashlib
+import io
+import json
+
+import cbor
+import pytest
+
+from sawtooth_sdk.protobuf import batch_pb2
+from sawtooth_sdk.protobuf import block_pb2
+from sawtooth_sdk.protobuf import processor_pb2
+from sawtooth_sdk.protobuf import state_context_pb2
+from sawtooth_sdk.protobuf import transaction_pb2
+
+from exceptions import CryptoportCliException
+from handler import CrypoportTransactionHandler
+from handler import FAMILY_NAME
+from handler import make_cryptoport_address
+from replay import ChainReplay, RECORD_HEADER, state_hash
+from replay import _decode_chunk, read_records, replay
+
+KEY = hashlib.sha512(b'retry').hexdigest()
+
+
+def _insert(signature, symbol='BTC', amount=1000):
+    return (signature, 'insert', 'name', json.dumps({
+        'symbol': symbol, 'type': 1, 'amount': amount, 'no_of_coins': 1.0,
+        'time_transacted': '01-01-2020'}), None)
+
+
+def _compact(signature, version, cutoff='01-01-2021'):
+    return (signature, 'compact', 'name', json.dumps({
+        'cutoff': cutoff, 'version': version}), None)
+
+
+def _records(chain):
+    return chain.state[make_cryptoport_address('name')]['name']
+
+
+def test_failed_compaction_rolls_back_its_whole_batch():
+    chain = ChainReplay()
+    chain.apply([[_insert('t1')]])
+    expected = state_hash(chain.address_hashes())
+
+    chain.apply([[_insert('t2'), _compact('t3', version=7)]])
+
+    assert chain.invalid_batches == 1
+    assert len(_records(chain)) == 1
+    assert chain.rollup_rows() == [['BTC', 1, 1000, 1.0]]
+    assert state_hash(chain.address_hashes()) == expected
+
+
+def test_batch_with_insert_and_compaction_applies_both():
+    chain = ChainReplay()
+    chain.apply([[_insert('t1')]])
+
+    chain.apply([[_insert('t2'), _compact('t3', version=0)]])
+
+    assert chain.invalid_batches == 0
+    assert _records(chain) == []
+    assert chain.rollup_rows() == [['BTC', 1, 2000, 2.0]]
+
+
+def test_replayed_rollups_are_unchanged_by_compaction():
+    compacted = ChainReplay()
+    plain = ChainReplay()
+    for chain in (compacted, plain):
+        chain.apply([[_insert('t1')], [_insert('t2', symbol='ETH')]])
+
+    compacted.apply([[_compact('t3', version=0)]])
+
+    assert compacted.rollup_rows() == plain.rollup_rows()
+
+
+def test_rollups_coerce_string_amounts():
+    chain = ChainReplay()
+    chain.apply([[('t1', 'insert', 'name', json.dumps({
+        'symbol': 'BTC', 'type': 1, 'amount': '1000',
+        'no_of_coins': '1.5'}), None)]])
+
+    assert chain.rollup_rows() == [['BTC', 1, 1000.0, 1.5]]
+
+
+def test_rollups_skip_records_that_are_not_objects():
+    chain = ChainReplay()
+    chain.apply([[('t1', 'insert', 'name', '5', None), _insert('t2')]])
+
+    assert chain.invalid_batches == 0
+    assert _records(chain) == [5, json.loads(_insert('t2')[3])]
+    assert chain.rollup_rows() == [['BTC', 1, 1000, 1.0]]
+
+
+def _transaction(signature, content, family_name=FAMILY_NAME):
+    payload = cbor.dumps(content)
+    header = transaction_pb2.TransactionHeader(
+        family_name=family_name, family_version='1.0',
+        payload_sha512=hashlib.sha512(payload).hexdigest())
+    return transaction_pb2.Transaction(
+        header=header.SerializeToString(),
+        header_signature=signature,
+        payload=payload)
+
+
+def _insert_transaction(signature, amount=1000, key=None):
+    content = {'Verb': 'insert', 'Name': 'name', 'Value': json.dumps({
+        'symbol': 'BTC', 'type': 1, 'amount': amount, 'no_of_coins': 1.0,
+        'time_transacted': '01-01-2020'})}
+    if key is not None:
+        content['Key'] = key
+    return _transaction(signature, content)
+
+
+def _batch(*transactions):
+    return batch_pb2.Batch(transactions=list(transactions))
+
+
+def _block(*batches):
+    return block_pb2.Block(batches=list(batches))
+
+
+def _dump(*messages):
+    stream = io.BytesIO()
+    for message in messages:
+        data = message.SerializeToString()
+        stream.write(RECORD_HEADER.pack(len(data)) + data)
+    stream.seek(0)
+    return stream
+
+
+def test_read_records_yields_each_record():
+    stream = io.BytesIO(
+        RECORD_HEADER.pack(3) + b'abc' + RECORD_HEADER.pack(0) +
+        RECORD_HEADER.pack(2) + b'de')
+
+    assert list(read_records(stream)) == [b'abc', b'', b'de']
+
+
+def test_read_records_rejects_a_truncated_header():
+    stream = io.BytesIO(RECORD_HEADER.pack(3) + b'abc' + b'\x00\x00')
+
+    with pytest.raises(CryptoportCliException, match='header'):
+        list(read_records(stream))
+
+
+def test_read_records_rejects_a_truncated_record():
+    stream = io.BytesIO(RECORD_HEADER.pack(5) + b'abc')
+
+    with pytest.raises(CryptoportCliException, match='Truncated record'):
+        list(read_records(stream))
+
+
+def test_decode_chunk_reads_blocks_and_batches():
+    batch = _batch(_insert_transaction('t1'),
+                   _transaction('other', {'Verb': 'set'}, 'intkey'))
+
+    from_blocks = _decode_chunk(
+        'blocks', [_block(batch, batch).SerializeToString()])
+    from_batch, = _decode_chunk('batches', [batch.SerializeToString()])
+
+    assert from_blocks == [from_batch, from_batch]
+    assert [signature for signature, *_ in from_batch] == ['t1']
+    assert from_batch[0][1:3] == ('insert', 'name')
+
+
+def test_decode_chunk_drops_batches_with_an_invalid_transaction():
+    invalid = _batch(_insert_transaction('t1'),
+                     _transaction('t2', {'Verb': 'delete', 'Name': 'name',
+                                         'Value': '{}'}))
+
+    assert _decode_chunk('batches', [invalid.SerializeToString()]) == [None]
+
+
+def test_replay_applies_chunks_in_chain_order():
+    blocks = [_block(_batch(_insert_transaction('t{}'.format(i), amount=i)))
+              for i in range(40)]
+
+    chain, _ = replay(_dump(*blocks), 'blocks', workers=3, chunk_size=1)
+
+    assert chain.records == 40
+    assert chain.transactions == 40
+    assert [r['amount'] for r in _records(chain)] == list(range(40))
+
+
+class _Context:
+    def __init__(self):
+        self.state = {}
+
+    def get_state(self, addresses, timeout=None):
+        return [state_context_pb2.TpStateEntry(
+                    address=address, data=self.state[address])
+                for address in addresses if address in self.state]
+
+    def set_state(self, entries, timeout=None):
+        self.state.update(entries)
+        return list(entries)
+
+
+def test_state_hash_matches_what_the_handler_writes():
+    transactions = [
+        _insert_transaction('t1'),
+        _insert_transaction('t2', amount=500, key=KEY),
+        _transaction('t3', {'Verb': 'compact', 'Name': 'name', 'Value':
+                            json.dumps({'cutoff': '01-01-2021'})}),
+        _insert_transaction('t4', amount=250),
+    ]
+
+    handler = CrypoportTransactionHandler()
+    context = _Context()
+    for transaction in transactions:
+        handler.apply(processor_pb2.TpProcessRequest(
+            header=transaction_pb2.TransactionHeader(),
+            payload=transaction.payload,
+            signature=transaction.header_signature), context)
+
+    chain, _ = replay(
+        _dump(*(_batch(t) for t in transactions)), 'batches', workers=2)
+
+    written = {address: hashlib.sha512(data).hexdigest()
+               for address, data in context.state.items()}
+    assert len(written) == 2
+    assert state_hash(chain.address_hashes()) == state_hash(written)
+
+
+def test_replayed_duplicate_key_invalidates_its_batch():
+    chain, _ = replay(_dump(
+        _batch(_insert_transaction('t1', key=KEY)),
+        _batch(_insert_transaction('t2', key=KEY))), 'batches', workers=1)
+
+    assert chain.batches == 2
+    assert chain.invalid_batches == 1
+    assert len(_records(chain)) == 1
@@ -0,0 +1,75 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import pytest
+
+import requestops
+from exceptions import CryptoportBackpressureException
+from exceptions import CryptoportClientException
+
+
+class _Response:
+    def __init__(self, status_code, headers=None, text=''):
+        self.status_code = status_code
+        self.reason = 'Reason'
+        self.headers = headers or {}
+        self.text = text
+        self.ok = status_code < 400
+
+
+@pytest.fixture
+def respond(monkeypatch):
+    def _respond(*args, **kwargs):
+        monkeypatch.setattr(requestops.requests, 'post',
+                            lambda url, headers, data: _Response(
+                                *args, **kwargs))
+    return _respond
+
+
+@pytest.mark.parametrize('status_code', [429, 503])
+def test_backpressure_status_raises_with_retry_after(respond, status_code):
+    respond(status_code, {'Retry-After': '2.5'})
+
+    with pytest.raises(CryptoportBackpressureException) as err:
+        requestops.send_request('http://rest-api:8008', 'batches', b'data')
+
+    assert err.value.retry_after == 2.5
+
+
+@pytest.mark.parametrize('headers', [{}, {'Retry-After': 'soon'}])
+def test_missing_or_unparsable_retry_after_is_none(respond, headers):
+    respond(429, headers)
+
+    with pytest.raises(CryptoportBackpressureException) as err:
+        requestops.send_request('http://rest-api:8008', 'batches', b'data')
+
+    assert err.value.retry_after is None
+
+
+def test_other_errors_are_not_backpressure(respond):
+    respond(500)
+
+    with pytest.raises(CryptoportClientException) as err:
+        requestops.send_request('http://rest-api:8008', 'batches', b'data')
+
+    assert not isinstance(err.value, CryptoportBackpressureException)
+
+
+def test_accepted_submission_returns_the_response(respond):
+    respond(202, text='{"link": "status"}')
+
+    assert requestops.send_request(
+        'http://rest-api:8008', 'batches', b'data') == (
+            '{"link": "status"}', 202)
@@ -0,0 +1,161 @@
+# Copyright 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import pytest
+
+from sawtooth_sdk.protobuf import batch_pb2
+
+import tranops
+from admission import SubmissionGate
+from exceptions import CryptoportBackpressureException
+from exceptions import CryptoportClientException
+from tranops import CryptoPort
+
+BATCH_LIST = batch_pb2.BatchList(
+    batches=[batch_pb2.Batch(header_signature='batch')])
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(tranops.time, 'time', clock.time)
+    monkeypatch.setattr(tranops.time, 'sleep', clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    gate = SubmissionGate(max_in_flight=1)
+    monkeypatch.setattr(tranops, 'SUBMISSIONS', gate)
+    return gate
+
+
+@pytest.fixture
+def windows(monkeypatch):
+    # Draws the top of every jitter window, and remembers the windows.
+    windows = []
+
+    def uniform(low, high):
+        windows.append((low, high))
+        return high
+    monkeypatch.setattr(tranops.random, 'uniform', uniform)
+    return windows
+
+
+def _responses(monkeypatch, *responses):
+    responses = list(responses)
+
+    def send_request(url, suffix, data=None, content_type=None):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+    monkeypatch.setattr(tranops, 'send_request', send_request)
+
+
+def _busy(retry_after=None):
+    return CryptoportBackpressureException('Error 429: Too Many Requests',
+                                           retry_after=retry_after)
+
+
+def test_queue_full_is_retried_with_growing_jitter(
+        monkeypatch, clock, gate, windows):
+    _responses(monkeypatch, _busy(), _busy(), ('{"link": "status"}', 202))
+
+    response = CryptoPort().send_transaction('http://rest-api:8008',
+                                             BATCH_LIST)
+
+    assert response == ('{"link": "status"}', 202)
+    assert windows == [(0, tranops.BACKOFF_BASE),
+                       (0, tranops.BACKOFF_BASE * 2)]
+    assert clock.sleeps == [tranops.BACKOFF_BASE, tranops.BACKOFF_BASE * 2]
+    snapshot = gate.snapshot()
+    assert snapshot['queue_full'] == 2
+    assert snapshot['retries'] == 2
+    assert snapshot['submitted'] == 1
+    assert snapshot['backing_off'] == 0
+    assert snapshot['in_flight'] == 0
+
+
+def test_jitter_window_is_capped(monkeypatch, clock, gate, windows):
+    _responses(monkeypatch, *[_busy()] * 8 + [('ok', 202)])
+
+    CryptoPort()._submit_batches('http://rest-api:8008', BATCH_LIST,
+                                 deadline=60)
+
+    assert max(high for _, high in windows) == tranops.BACKOFF_MAX
+
+
+def test_retry_after_is_a_floor_for_the_delay(
+        monkeypatch, clock, gate, windows):
+    _responses(monkeypatch, _busy(retry_after=1.5), ('ok', 202))
+
+    CryptoPort()._submit_batches('http://rest-api:8008', BATCH_LIST,
+                                 deadline=10)
+
+    assert clock.sleeps == [1.5]
+
+
+def test_retries_stop_at_the_deadline(monkeypatch, clock, gate, windows):
+    _responses(monkeypatch, *[_busy()] * 10)
+
+    with pytest.raises(CryptoportBackpressureException):
+        CryptoPort().send_transaction('http://rest-api:8008', BATCH_LIST,
+                                      deadline=1)
+
+    # 0.1 + 0.2 + 0.4 fits in the deadline, another 0.8 would not.
+    assert clock.sleeps == pytest.approx([0.1, 0.2, 0.4])
+    assert clock.now <= 1
+    snapshot = gate.snapshot()
+    assert snapshot['queue_full'] == 4
+    assert snapshot['retries'] == 3
+    assert snapshot['submitted'] == 0
+    assert snapshot['in_flight'] == 0
+
+
+def test_retry_after_past_the_deadline_gives_up_at_once(
+        monkeypatch, clock, gate, windows):
+    _responses(monkeypatch, _busy(retry_after=30))
+
+    with pytest.raises(CryptoportBackpressureException) as err:
+        CryptoPort()._submit_batches('http://rest-api:8008', BATCH_LIST,
+                                     deadline=10)
+
+    assert err.value.retry_after == 30
+    assert clock.sleeps == []
+
+
+def test_other_errors_are_not_retried(monkeypatch, clock, gate, windows):
+    _responses(monkeypatch, CryptoportClientException('Error 500'))
+
+    with pytest.raises(CryptoportClientException):
+        CryptoPort().send_transaction('http://rest-api:8008', BATCH_LIST)
+
+    assert clock.sleeps == []
+    assert gate.snapshot()['queue_full'] == 0
+    assert gate.snapshot()['in_flight'] == 0
@@ -27,11 +27,19 @@ from requestops import send_request
 from sawtooth_sdk.protobuf import batch_pb2
 from sawtooth_sdk.protobuf import transaction_pb2
 from exceptions import CryptoportClientException
+from exceptions import CryptoportBackpressureException
+from admission import SUBMISSIONS
 
 LOGGER = logging.getLogger(__name__)
 
 FAMILY_NAME = 'cryptoport'
 
+# Seconds a submission keeps retrying while the validator pushes back.
+SUBMIT_DEADLINE = 10
+
+BACKOFF_BASE = 0.1
+BACKOFF_MAX = 2.0
+
 
 def _sha512(data):
     return hashlib.sha512(data).hexdigest()
@@ -44,21 +52,37 @@ def _get_address(name):
     game_address = _sha512(name.encode('utf-8'))[0:64]
     return prefix + game_address
 
+def _get_idempotency_address(key):
+    return _get_address('key:' + key)
+
+def idempotency_digest(idempotency_key, value):
+    """Derives the key a transaction is deduplicated by.
+
+    The same client key and record always give the same digest, and with it
+    the same nonce.
+    """
+    record = json.dumps(value, sort_keys=True)
+    return _sha512('{}:{}'.format(idempotency_key, record).encode('utf-8'))
+
 class CryptoportPayload:
-    def __init__(self, verb, name, value):
+    def __init__(self, verb, name, value, key=None):
         self._verb = verb
         self._name = name
         self._value = json.dumps(value)
+        self._key = key
 
         self._cbor = None
         self._sha512 = None
 
     def to_hash(self):
-        return {
+        content = {
             'Verb': self._verb,
             'Name': self._name,
             'Value': self._value
         }
+        if self._key is not None:
+            content['Key'] = self._key
+        return content
 
     def to_cbor(self):
         if self._cbor is None:
@@ -73,20 +97,32 @@ class CryptoportPayload:
 
 class CryptoPort():
 
-    def create_cryptoport_transactions(verb, name, value, signer, deps=[]):
+    def create_cryptoport_transactions(verb, name, value, signer, deps=[],
+                                       idempotency_key=None):
         """Creates a signed Cryptoport transaction.
+
+        With an idempotency key the nonce is derived from the key and the
+        value instead of being random, and the processor rejects repeats.
         """
 
         # The prefix should eventually be looked up from the
         # validator's namespace registry.
         addr = [[_get_address(name)]]
+
+        key   = None
+        nonce = hex(random.randint(0, 2**64))
+        if idempotency_key is not None:
+            key   = idempotency_digest(idempotency_key, value)
+            nonce = key[0:32]
+            addr  = [a + [_get_idempotency_address(key)] for a in addr]
         
         transactions = []
         for a in addr:
             payload = CryptoportPayload(
                 verb = verb, 
                 name = name,
-                value =value)
+                value =value,
+                key = key)
 
             header = transaction_pb2.TransactionHeader(
                 signer_public_key=signer.get_public_key().as_hex(),
@@ -97,7 +133,7 @@ class CryptoPort():
                 dependencies=deps,
                 payload_sha512=payload.sha512(),
                 batcher_public_key=signer.get_public_key().as_hex(),
-                nonce=hex(random.randint(0, 2**64)))
+                nonce=nonce)
 
             header_bytes = header.SerializeToString()
 
@@ -128,17 +164,47 @@ class CryptoPort():
 
         return batch_pb2.BatchList(batches=[batch])
 
-    def send_transaction(self, url, batch_list, wait=None):
+    def send_transaction(self, url, batch_list, wait=None,
+                         deadline=SUBMIT_DEADLINE):
         batch_id = batch_list.batches[0].header_signature
 
-        response = send_request(url,
-            "batches", batch_list.SerializeToString(),
-            'application/octet-stream',
-        )
+        with SUBMISSIONS.slot():
+            response = self._submit_batches(url, batch_list, deadline)
+        SUBMISSIONS.record_submitted()
 
         if self.wait_done(batch_id, wait):
             return response
                 
+    def _submit_batches(self, url, batch_list, deadline):
+        """Posts the batches, backing off with full jitter on QUEUE_FULL.
+
+        Gives up with the last backpressure error once the next attempt
+        would land past the deadline.
+        """
+        give_up_at = time.time() + (deadline or 0)
+        data       = batch_list.SerializeToString()
+        attempt    = 0
+        while True:
+            try:
+                return send_request(url,
+                    "batches", data,
+                    'application/octet-stream',
+                )
+            except CryptoportBackpressureException as err:
+                delay = random.uniform(
+                    0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                if err.retry_after is not None:
+                    delay = max(delay, err.retry_after)
+
+                if time.time() + delay > give_up_at:
+                    SUBMISSIONS.record_queue_full()
+                    raise
+
+                LOGGER.debug('Validator busy, retrying in %.2fs', delay)
+                with SUBMISSIONS.backing_off():
+                    time.sleep(delay)
+                attempt += 1
+
     def wait_done(self, batch_id, wait, status='PENDING', start_time=None):
         args       = batch_id, wait
         localargs  = dict(status=status, start_time=start_time)